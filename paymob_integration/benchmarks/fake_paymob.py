@@ -0,0 +1,207 @@
+"""Local stand-in for the Paymob KSA API and WAHA, for benchmarks.
+
+Answers the endpoints the integration calls with well-formed responses,
+after a configurable delay, and fails a configurable share of requests.
+Needs no site:
+
+    python -m paymob_integration.benchmarks.fake_paymob --port 8765 --latency-ms 80 --error-rate 0.01
+
+Point a site at it with `bench --site mysite set-config paymob_base_url http://127.0.0.1:8765`
+and, for WhatsApp, set WAHA API URL in Paymob Settings to the same address.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_AMOUNT_CENTS = 100
+
+
+class FakePaymob:
+	"""Threaded HTTP server faking Paymob and WAHA.
+
+	`latency_ms` (+/- `jitter_ms`) is added to every response and
+	`error_rate` of requests get `error_status` instead. A 429 comes with
+	a Retry-After header.
+	"""
+
+	def __init__(
+		self, host="127.0.0.1", port=0, latency_ms=0, jitter_ms=0, error_rate=0.0, error_status=500, seed=None
+	):
+		self.latency_ms = latency_ms
+		self.jitter_ms = jitter_ms
+		self.error_rate = error_rate
+		self.error_status = error_status
+		self.random = random.Random(seed)
+
+		self.requests = {}
+		self.errors = {}
+		self._orders = {}
+		self._ids = itertools.count(100000)
+		self._lock = threading.Lock()
+
+		self.routes = {
+			"/api/auth/tokens": self.auth_token,
+			"/api/ecommerce/orders": self.create_order,
+			"/api/acceptance/payment_keys": self.payment_key,
+			"/api/ecommerce/orders/transaction_inquiry": self.transaction_inquiry,
+			"/api/sendText": self.send_text,
+		}
+
+		self.server = ThreadingHTTPServer((host, port), self._handler_class())
+		self.server.daemon_threads = True
+		self._thread = None
+
+	@property
+	def base_url(self):
+		host, port = self.server.server_address[:2]
+		return f"http://{host}:{port}"
+
+	def start(self):
+		self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self._thread.start()
+		return self.base_url
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def stats(self):
+		with self._lock:
+			return {"requests": dict(self.requests), "errors": dict(self.errors)}
+
+	# Endpoints: each takes the JSON payload and returns (status, body)
+
+	def auth_token(self, payload):
+		if not payload.get("api_key"):
+			return 403, {"detail": "Incorrect credentials"}
+		return 201, {"token": secrets.token_hex(32), "profile": {"id": 1}}
+
+	def create_order(self, payload):
+		order_id = self._next_id()
+		with self._lock:
+			self._orders[order_id] = payload
+		return 201, {
+			"id": order_id,
+			"merchant_order_id": payload.get("merchant_order_id"),
+			"amount_cents": payload.get("amount_cents"),
+			"currency": payload.get("currency"),
+		}
+
+	def payment_key(self, payload):
+		return 201, {"token": secrets.token_hex(64)}
+
+	def transaction_inquiry(self, payload):
+		order_id = payload.get("order_id")
+		with self._lock:
+			order = self._orders.get(order_id) or {}
+		return 200, {
+			"id": self._next_id(),
+			"pending": False,
+			"success": True,
+			"amount_cents": order.get("amount_cents") or DEFAULT_AMOUNT_CENTS,
+			"currency": order.get("currency") or "SAR",
+			"order": {"id": order_id, "merchant_order_id": order.get("merchant_order_id")},
+		}
+
+	def send_text(self, payload):
+		return 201, {"id": f"true_{payload.get('chatId')}_{secrets.token_hex(8)}"}
+
+	def _next_id(self):
+		with self._lock:
+			return next(self._ids)
+
+	def _respond(self, path, payload):
+		with self._lock:
+			self.requests[path] = self.requests.get(path, 0) + 1
+			failed = self.random.random() < self.error_rate
+			delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+			if failed:
+				self.errors[path] = self.errors.get(path, 0) + 1
+
+		if delay:
+			time.sleep(delay)
+
+		handler = self.routes.get(path)
+		if handler is None:
+			return 404, {"detail": "Not found"}, {}
+		if failed:
+			headers = {"Retry-After": "1"} if self.error_status == 429 else {}
+			return self.error_status, {"detail": "Injected error"}, headers
+		status, body = handler(payload)
+		return status, body, {}
+
+	def _handler_class(self):
+		fake = self
+
+		class Handler(BaseHTTPRequestHandler):
+			# Keep-alive, like the real API, so pooled clients are measured fairly
+			protocol_version = "HTTP/1.1"
+
+			def do_POST(self):
+				length = int(self.headers.get("Content-Length") or 0)
+				try:
+					payload = json.loads(self.rfile.read(length) or b"{}")
+				except ValueError:
+					payload = {}
+
+				status, body, headers = fake._respond(self.path.split("?", 1)[0], payload)
+				data = json.dumps(body).encode()
+				self.send_response(status)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(data)))
+				for key, value in headers.items():
+					self.send_header(key, value)
+				self.end_headers()
+				self.wfile.write(data)
+
+			def log_message(self, format, *args):
+				pass
+
+		return Handler
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--latency-ms", type=float, default=0)
+	parser.add_argument("--jitter-ms", type=float, default=0)
+	parser.add_argument("--error-rate", type=float, default=0.0)
+	parser.add_argument("--error-status", type=int, default=500)
+	parser.add_argument("--seed", type=int)
+	args = parser.parse_args()
+
+	fake = FakePaymob(
+		host=args.host,
+		port=args.port,
+		latency_ms=args.latency_ms,
+		jitter_ms=args.jitter_ms,
+		error_rate=args.error_rate,
+		error_status=args.error_status,
+		seed=args.seed,
+	)
+	print(f"Fake Paymob listening on {fake.base_url}", flush=True)
+	try:
+		fake.server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		print(json.dumps(fake.stats(), indent=2))
+		fake.server.server_close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,100 @@
+"""Micro-benchmark for Paymob webhook HMAC verification.
+
+Compares the field-list verifier and the raw-body verifier with the old
+parse + json.dumps + SHA-256 approach. Needs no site:
+
+    python -m paymob_integration.benchmarks.hmac_bench --number 20000
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import timeit
+
+from paymob_integration.paymob_integration.signature import (
+	compute_transaction_hmac,
+	verify_raw_body_hmac,
+	verify_transaction_hmac,
+)
+
+SECRET = "3B1F8E0C5D6A4B2E9F7C1D3A5B8E0F2C"
+
+SAMPLE_CALLBACK = {
+	"type": "TRANSACTION",
+	"obj": {
+		"id": 192036465,
+		"pending": False,
+		"amount_cents": 115000,
+		"success": True,
+		"is_auth": False,
+		"is_capture": False,
+		"is_standalone_payment": True,
+		"is_voided": False,
+		"is_refunded": False,
+		"is_3d_secure": True,
+		"integration_id": 16745,
+		"has_parent_transaction": False,
+		"order": {
+			"id": 217503754,
+			"created_at": "2026-10-17T10:21:41.560424",
+			"merchant_order_id": "SAL-ORD-2026-00042-a1b2c3",
+			"amount_cents": 115000,
+			"currency": "SAR",
+			"items": [{"name": f"Item {i}", "amount_cents": 11500, "quantity": 1} for i in range(10)],
+		},
+		"created_at": "2026-10-17T10:22:05.014237",
+		"currency": "SAR",
+		"error_occured": False,
+		"owner": 302852,
+		"source_data": {"type": "card", "pan": "2346", "sub_type": "MasterCard"},
+		"data": {"message": "Approved", "txn_response_code": "APPROVED"},
+	},
+}
+
+
+def legacy_verify(body, received, secret):
+	"""What paymob_webhook used to do: parse, re-serialize, SHA-256"""
+	payload = json.dumps(json.loads(body), separators=(",", ":"))
+	expected = hmac.new(secret.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+	return hmac.compare_digest(received, expected)
+
+
+def run(number=20000):
+	body = json.dumps(SAMPLE_CALLBACK).encode()
+	webhook_data = json.loads(body)
+
+	field_hmac = compute_transaction_hmac(webhook_data["obj"], SECRET)
+	body_hmac = hmac.new(SECRET.encode(), body, hashlib.sha512).hexdigest()
+	legacy_hmac = hmac.new(
+		SECRET.encode(), json.dumps(webhook_data, separators=(",", ":")).encode(), hashlib.sha256
+	).hexdigest()
+
+	assert verify_transaction_hmac(webhook_data["obj"], field_hmac, SECRET)
+	assert verify_raw_body_hmac(body, body_hmac, SECRET)
+	assert legacy_verify(body, legacy_hmac, SECRET)
+
+	cases = {
+		# The webhook parses the body once anyway, so the field-list path starts from parsed data
+		"field_list_sha512": lambda: verify_transaction_hmac(webhook_data["obj"], field_hmac, SECRET),
+		"raw_body_sha512": lambda: verify_raw_body_hmac(body, body_hmac, SECRET),
+		"legacy_parse_dump_sha256": lambda: legacy_verify(body, legacy_hmac, SECRET),
+	}
+
+	results = {}
+	for name, fn in cases.items():
+		seconds = min(timeit.repeat(fn, number=number, repeat=5))
+		results[name] = {
+			"us_per_op": round(seconds / number * 1e6, 2),
+			"ops_per_sec": round(number / seconds),
+		}
+	return results
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+	)
+	parser.add_argument("--number", type=int, default=20000)
+	args = parser.parse_args()
+	print(json.dumps(run(args.number), indent=2))
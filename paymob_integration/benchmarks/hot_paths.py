@@ -0,0 +1,187 @@
+"""Throughput and latency of the Paymob hot paths against a local stand-in.
+
+Drives `create_payment_link_v2`, `paymob_webhook` and
+`inquire_and_create_payment_entry` at a fixed concurrency. Each worker
+thread has its own database connection, and every call is rolled back,
+so the Sales Orders are left untouched. Run it on a site with Paymob
+Settings filled in (any credentials will do for the stand-in):
+
+    bench --site mysite execute paymob_integration.benchmarks.hot_paths.run \
+        --kwargs "{'sales_orders': 'SAL-ORD-2025-00001,SAL-ORD-2025-00002', 'number': 500, 'concurrency': 16}"
+
+Prints a JSON report with p50/p95/p99 and ops/sec per scenario; pass
+`output` to also write it to a file for regression tracking.
+"""
+
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.utils import cint, flt
+from werkzeug.test import EnvironBuilder
+
+from paymob_integration.benchmarks.fake_paymob import FakePaymob
+from paymob_integration.benchmarks.stats import summarize
+from paymob_integration.paymob_integration import api, payment_link
+from paymob_integration.paymob_integration.settings import get_settings
+from paymob_integration.paymob_integration.signature import compute_transaction_hmac
+
+SCENARIOS = ("create_payment_link_v2", "paymob_webhook", "inquire_and_create_payment_entry")
+
+_transaction_ids = itertools.count(int(time.time() * 1000))
+
+
+def run(
+	sales_orders,
+	scenarios=SCENARIOS,
+	number=200,
+	concurrency=8,
+	fake=True,
+	latency_ms=50,
+	jitter_ms=10,
+	error_rate=0.0,
+	output=None,
+):
+	"""Run each scenario `number` times over the given submitted Sales Orders.
+
+	With `fake` (the default) a local stand-in answers the Paymob calls; turn
+	it off only to measure against whatever `paymob_base_url` points to.
+	"""
+	if isinstance(sales_orders, str):
+		sales_orders = [name.strip() for name in sales_orders.split(",") if name.strip()]
+	if isinstance(scenarios, str):
+		scenarios = [name.strip() for name in scenarios.split(",") if name.strip()]
+	if not sales_orders:
+		frappe.throw("Pass at least one submitted Sales Order")
+
+	orders = frappe.get_all(
+		"Sales Order",
+		filters={"name": ["in", sales_orders], "docstatus": 1},
+		fields=["name", "grand_total", "currency", "paymob_order_id", "paymob_merchant_order_id"],
+	)
+	if not orders:
+		frappe.throw("None of the Sales Orders are submitted")
+
+	fake_server = None
+	base_url = None
+	if cint(fake):
+		fake_server = FakePaymob(
+			latency_ms=flt(latency_ms), jitter_ms=flt(jitter_ms), error_rate=flt(error_rate)
+		)
+		base_url = fake_server.start()
+
+	report = {
+		"config": {
+			"number": cint(number),
+			"concurrency": cint(concurrency),
+			"sales_orders": len(orders),
+			"fake": bool(fake_server),
+			"latency_ms": flt(latency_ms),
+			"jitter_ms": flt(jitter_ms),
+			"error_rate": flt(error_rate),
+		},
+		"scenarios": {},
+	}
+	try:
+		for scenario in scenarios:
+			if scenario not in SCENARIOS:
+				frappe.throw(f"Unknown scenario {scenario}")
+			report["scenarios"][scenario] = _run_scenario(
+				scenario, orders, cint(number), cint(concurrency), base_url
+			)
+	finally:
+		if fake_server:
+			report["fake_paymob"] = fake_server.stats()
+			fake_server.stop()
+
+	print(json.dumps(report, indent=2))
+	if output:
+		with open(output, "w") as f:
+			json.dump(report, f, indent=2)
+	return report
+
+
+def _run_scenario(scenario, orders, number, concurrency, base_url):
+	call = globals()[f"_call_{scenario}"]
+	hmac_secret = get_settings().hmac
+
+	def one(i):
+		order = orders[i % len(orders)]
+		started = time.perf_counter()
+		try:
+			call(order, hmac_secret)
+			ok = True
+		except Exception:
+			ok = False
+		finally:
+			frappe.db.rollback()
+			frappe.local.message_log = []
+		return (time.perf_counter() - started) * 1000, ok
+
+	with ThreadPoolExecutor(
+		max_workers=concurrency,
+		initializer=_init_worker,
+		initargs=(frappe.local.site, frappe.local.sites_path, base_url),
+	) as executor:
+		started = time.perf_counter()
+		results = list(executor.map(one, range(number)))
+		seconds = time.perf_counter() - started
+
+	return summarize(
+		[ms for ms, ok in results if ok],
+		seconds=seconds,
+		errors=sum(1 for _ms, ok in results if not ok),
+	)
+
+
+def _init_worker(site, sites_path, base_url):
+	frappe.init(site, sites_path)
+	frappe.connect()
+	frappe.set_user("Administrator")
+	if base_url:
+		frappe.local.conf.paymob_base_url = base_url
+
+
+def _call_create_payment_link_v2(order, hmac_secret):
+	# Measure the full Paymob chain, not the link cache
+	payment_link.clear_link_cache(order.name)
+	api.create_payment_link_v2(order.name)
+
+
+def _call_inquire_and_create_payment_entry(order, hmac_secret):
+	api.inquire_and_create_payment_entry(order.name)
+
+
+def _call_paymob_webhook(order, hmac_secret):
+	obj = {
+		"id": next(_transaction_ids),
+		"pending": False,
+		"success": True,
+		"amount_cents": round(flt(order.grand_total) * 100),
+		"currency": order.currency,
+		"created_at": "2025-01-01T00:00:00.000000",
+		"error_occured": False,
+		"has_parent_transaction": False,
+		"integration_id": 1,
+		"is_3d_secure": True,
+		"is_auth": False,
+		"is_capture": False,
+		"is_refunded": False,
+		"is_standalone_payment": True,
+		"is_voided": False,
+		"owner": 1,
+		"order": {
+			"id": order.paymob_order_id,
+			"merchant_order_id": order.paymob_merchant_order_id or order.name,
+		},
+		"source_data": {"pan": "2346", "sub_type": "MasterCard", "type": "card"},
+	}
+	frappe.local.request = EnvironBuilder(
+		method="POST",
+		path="/api/method/paymob_integration.paymob_integration.api.paymob_webhook",
+		query_string={"hmac": compute_transaction_hmac(obj, hmac_secret or "")},
+		json={"type": "TRANSACTION", "obj": obj},
+	).get_request()
+	api.paymob_webhook()
@@ -0,0 +1,28 @@
+import statistics
+
+
+def percentile(sorted_samples, pct):
+	"""Nearest-rank percentile of an already sorted list"""
+	index = min(len(sorted_samples) - 1, round(pct / 100 * (len(sorted_samples) - 1)))
+	return sorted_samples[index]
+
+
+def summarize(samples_ms, seconds=None, errors=0):
+	"""Latency summary in milliseconds, plus throughput when the wall time is known"""
+	samples = sorted(samples_ms)
+	if not samples:
+		return {"number": 0, "errors": errors}
+
+	result = {
+		"number": len(samples),
+		"errors": errors,
+		"mean_ms": round(statistics.fmean(samples), 2),
+		"p50_ms": round(percentile(samples, 50), 2),
+		"p95_ms": round(percentile(samples, 95), 2),
+		"p99_ms": round(percentile(samples, 99), 2),
+		"max_ms": round(samples[-1], 2),
+	}
+	if seconds:
+		result["seconds"] = round(seconds, 3)
+		result["ops_per_sec"] = round(len(samples) / seconds, 2)
+	return result
@@ -0,0 +1,37 @@
+"""Sales Order submit latency with the Paymob submit hook in place.
+
+Submits copies of an existing draft Sales Order and rolls everything back
+afterwards. Run it on a site, before and after a change to the hook:
+
+    bench --site mysite execute paymob_integration.benchmarks.submit_bench.run \
+        --kwargs "{'template': 'SAL-ORD-2025-00001', 'number': 50}"
+"""
+
+import json
+import time
+
+import frappe
+
+from paymob_integration.benchmarks.stats import summarize
+
+
+def run(template, number=50):
+	source = frappe.get_doc("Sales Order", template)
+	if source.docstatus != 0:
+		frappe.throw("The template Sales Order must be a draft")
+
+	samples = []
+	try:
+		for _i in range(int(number)):
+			doc = frappe.copy_doc(source)
+			doc.insert(ignore_permissions=True)
+
+			started = time.perf_counter()
+			doc.submit()
+			samples.append((time.perf_counter() - started) * 1000)
+	finally:
+		frappe.db.rollback()
+
+	result = summarize(samples)
+	print(json.dumps(result, indent=2))
+	return result
@@ -43,8 +43,8 @@ app_license = "mit"
 # page_js = {"page" : "public/js/file.js"}
 
 # include js in doctype views
-doctype_js = {"Sales Order" : "paymob_integration/doctype/sales_order/sales_order.js"}
-# doctype_list_js = {"doctype" : "public/js/doctype_list.js"}
+doctype_js = {"Sales Order": "paymob_integration/doctype/sales_order/sales_order.js"}
+doctype_list_js = {"Sales Order": "paymob_integration/doctype/sales_order/sales_order_list.js"}
 # doctype_tree_js = {"doctype" : "public/js/doctype_tree.js"}
 # doctype_calendar_js = {"doctype" : "public/js/doctype_calendar.js"}
 
@@ -83,7 +83,7 @@ doctype_js = {"Sales Order" : "paymob_integration/doctype/sales_order/sales_orde
 # ------------
 
 # before_install = "paymob_integration.install.before_install"
-# after_install = "paymob_integration.install.after_install"
+after_install = "paymob_integration.install.after_install"
 
 # Uninstallation
 # ------------
@@ -139,30 +139,29 @@ doctype_js = {"Sales Order" : "paymob_integration/doctype/sales_order/sales_orde
 
 doc_events = {
 	"Sales Order": {
-		"on_submit": "paymob_integration.paymob_integration.api.initialize_paymob_integration"
+		"before_submit": "paymob_integration.paymob_integration.api.initialize_paymob_integration",
+		"on_cancel": "paymob_integration.paymob_integration.payment_link.clear_link_cache_on_cancel",
 	}
 }
 
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"paymob_integration.tasks.all"
-# 	],
-# 	"daily": [
-# 		"paymob_integration.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"paymob_integration.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"paymob_integration.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"paymob_integration.tasks.monthly"
-# 	],
-# }
+# Extra tracing sinks; every Paymob span is also folded into the shared metrics
+paymob_trace_sinks = ["paymob_integration.paymob_integration.metrics.RedisSpanSink"]
+
+scheduler_events = {
+	"all": [
+		"paymob_integration.paymob_integration.webhook_queue.drain_webhook_inbox",
+		"paymob_integration.paymob_integration.whatsapp_outbox.drain_whatsapp_outbox",
+	],
+	"daily": [
+		"paymob_integration.paymob_integration.webhook_queue.clear_processed_events",
+	],
+	"cron": {
+		"*/15 * * * *": ["paymob_integration.paymob_integration.reconciliation.reconcile_pending_orders"],
+	},
+}
 
 # Testing
 # -------
@@ -239,4 +238,3 @@ doc_events = {
 # default_log_clearing_doctypes = {
 # 	"Logging DocType Name": 30  # days to retain logs
 # }
-
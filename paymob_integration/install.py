@@ -0,0 +1,73 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+# Not copied, so amended and duplicated Sales Orders get their own Paymob order
+SALES_ORDER_CUSTOM_FIELDS = [
+	{
+		"fieldname": "paymob_order_id",
+		"label": "Paymob Order ID",
+		"fieldtype": "Data",
+		"insert_after": "delivery_date",
+		"search_index": 1,
+		"read_only": 1,
+		"allow_on_submit": 1,
+		"no_copy": 1,
+	},
+	{
+		"fieldname": "paymob_merchant_order_id",
+		"label": "Paymob Merchant Order ID",
+		"fieldtype": "Data",
+		"insert_after": "paymob_order_id",
+		"search_index": 1,
+		"read_only": 1,
+		"allow_on_submit": 1,
+		"no_copy": 1,
+	},
+	{
+		"fieldname": "paymob_transaction_id",
+		"label": "Paymob Transaction ID",
+		"fieldtype": "Data",
+		"insert_after": "paymob_merchant_order_id",
+		"read_only": 1,
+		"allow_on_submit": 1,
+		"no_copy": 1,
+	},
+	{
+		"fieldname": "paymob_payment_status",
+		"label": "Paymob Payment Status",
+		"fieldtype": "Select",
+		"options": "Pending\nPaid\nFailed",
+		"insert_after": "paymob_transaction_id",
+		"read_only": 1,
+		"allow_on_submit": 1,
+		"no_copy": 1,
+	},
+	{
+		"fieldname": "paymob_payment_link",
+		"label": "Paymob Payment Link",
+		"fieldtype": "Small Text",
+		"insert_after": "paymob_payment_status",
+		"read_only": 1,
+		"allow_on_submit": 1,
+		"no_copy": 1,
+	},
+	{
+		"fieldname": "paymob_payment_entry",
+		"label": "Paymob Payment Entry",
+		"fieldtype": "Link",
+		"options": "Payment Entry",
+		"insert_after": "paymob_payment_link",
+		"read_only": 1,
+		"allow_on_submit": 1,
+		"no_copy": 1,
+	},
+]
+
+
+def after_install():
+	setup_custom_fields()
+
+
+def setup_custom_fields():
+	"""Create or update the Paymob custom fields on Sales Order (install and migrate only)"""
+	create_custom_fields({"Sales Order": SALES_ORDER_CUSTOM_FIELDS}, ignore_validate=True, update=True)
@@ -0,0 +1,54 @@
+import frappe
+
+from paymob_integration.paymob_integration import transactions
+
+BATCH_SIZE = 1000
+
+
+def execute():
+	"""Seed the Paymob Transaction ledger with the last known state of every Sales Order"""
+	if not frappe.get_meta("Sales Order").has_field("paymob_order_id"):
+		return
+	if frappe.db.count("Paymob Transaction"):
+		return
+
+	last_name = ""
+	while True:
+		orders = frappe.get_all(
+			"Sales Order",
+			filters={"paymob_order_id": ["is", "set"], "name": [">", last_name]},
+			fields=[
+				"name",
+				"currency",
+				"grand_total",
+				"paymob_order_id",
+				"paymob_merchant_order_id",
+				"paymob_transaction_id",
+				"paymob_payment_status",
+				"paymob_payment_entry",
+			],
+			order_by="name asc",
+			limit=BATCH_SIZE,
+		)
+		if not orders:
+			break
+		last_name = orders[-1].name
+
+		transactions.record(
+			[
+				{
+					"sales_order": order.name,
+					"status": order.paymob_payment_status
+					if order.paymob_payment_status in ("Paid", "Failed")
+					else "Pending",
+					"merchant_order_id": order.paymob_merchant_order_id,
+					"paymob_order_id": order.paymob_order_id,
+					"transaction_id": order.paymob_transaction_id,
+					"amount": order.grand_total,
+					"currency": order.currency,
+					"payment_entry": order.paymob_payment_entry,
+				}
+				for order in orders
+			],
+			notify=False,
+		)
@@ -0,0 +1,6 @@
+from paymob_integration.install import setup_custom_fields
+
+
+def execute():
+	"""Stop amended and duplicated Sales Orders from inheriting the Paymob order of the original"""
+	setup_custom_fields()
@@ -0,0 +1,6 @@
+from paymob_integration.install import setup_custom_fields
+
+
+def execute():
+	"""Provision the Sales Order custom fields that used to be created on every submit"""
+	setup_custom_fields()
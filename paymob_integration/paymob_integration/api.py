@@ -1,49 +1,67 @@
-import frappe
-import json
-import requests
 import hashlib
 import hmac
+import json
+
+import frappe
+import requests
 from frappe import _
-from frappe.utils import now, flt, cstr, cint, random_string
-from frappe.model.document import Document
 from frappe.desk.form.load import get_attachments
+from frappe.model.document import Document
+from frappe.utils import cint, cstr, flt, now, random_string
+from werkzeug.wrappers import Response
+
+from paymob_integration.install import setup_custom_fields
+from paymob_integration.paymob_integration import (
+    metrics,
+    payment_email,
+    payment_link,
+    payment_status,
+    transport,
+    webhook_dedup,
+    webhook_queue,
+    whatsapp,
+    whatsapp_outbox,
+)
+from paymob_integration.paymob_integration.payment_posting import (
+    post_payment_entries,
+    record_failed_payment,
+    transaction_from_webhook,
+)
+from paymob_integration.paymob_integration.settings import get_settings
+from paymob_integration.paymob_integration.signature import verify_raw_body_hmac, verify_transaction_hmac
+from paymob_integration.paymob_integration.token_cache import (
+    authed_post,
+    call_with_auth_token,
+    get_auth_token,
+)
+from paymob_integration.paymob_integration.transport import PAYMOB_BASE_URL
 
 
 class PaymobAPI:
     """Paymob API Integration Class"""
     
     def __init__(self):
-        self.settings = frappe.get_single("Paymob Settings")
+        self.settings = get_settings()
         self.api_key = self.settings.api_key
         self.hmac = self.settings.hmac
         self.secret_key = self.settings.secret_key
         self.public_key = self.settings.public_key
-        self.base_url = "https://ksa.paymob.com/api"
+        self.base_url = f"{PAYMOB_BASE_URL}/api"
         
     def get_auth_token(self):
-        """Get authentication token from Paymob"""
-        url = f"{self.base_url}/auth/tokens"
-        
-        payload = {
-            "api_key": self.api_key
-        }
-        
-        try:
-            response = requests.post(url, json=payload)
-            # Paymob returns 201 for successful authentication
-            if response.status_code in [200, 201]:
-                data = response.json()
-                return data.get("token")
-            else:
-                response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            frappe.log_error(f"Paymob Auth Token Error: {str(e)}", "Paymob API Error")
-            frappe.throw(_("Failed to authenticate with Paymob. Please check your API credentials."))
+        """Get authentication token from Paymob (shared process-wide cache)"""
+        return get_auth_token(self.api_key)
+
+    def _post_with_auth(self, url, payload):
+        """POST `payload` with a cached auth token, re-authenticating once on HTTP 401"""
+        return call_with_auth_token(
+            self.api_key,
+            lambda token: transport.post(url, json={**payload, "auth_token": token}),
+        )
     
+    @metrics.timer("PaymobAPI.create_order")
     def create_order(self, sales_order):
         """Create order in Paymob"""
-        token = self.get_auth_token()
-        
         url = f"{self.base_url}/ecommerce/orders"
         
         # Calculate total amount in cents (Paymob expects amount in cents)
@@ -56,7 +74,6 @@ class PaymobAPI:
             sales_order.db_set("paymob_merchant_order_id", merchant_order_id)
 
         payload = {
-            "auth_token": token,
             "delivery_needed": False,
             "amount_cents": str(total_amount),
             "currency": (sales_order.currency or "SAR").upper(),
@@ -74,7 +91,7 @@ class PaymobAPI:
             })
         
         try:
-            response = requests.post(url, json=payload, timeout=30)
+            response = self._post_with_auth(url, payload)
             if response.status_code not in [200, 201]:
                 try:
                     error_body = response.text
@@ -89,7 +106,7 @@ class PaymobAPI:
                     merchant_order_id = f"{sales_order.name}-{random_string(6)}"
                     sales_order.db_set("paymob_merchant_order_id", merchant_order_id)
                     payload["merchant_order_id"] = merchant_order_id
-                    retry_resp = requests.post(url, json=payload, timeout=30)
+                    retry_resp = self._post_with_auth(url, payload)
                     if retry_resp.status_code in [200, 201]:
                         data = retry_resp.json()
                         sales_order.db_set("paymob_order_id", data.get("id"))
@@ -112,10 +129,9 @@ class PaymobAPI:
             frappe.log_error(f"Paymob Create Order Error: {str(e)}", "Paymob API Error")
             frappe.throw(_(f"Failed to create order in Paymob. ({str(e)})"))
     
+    @metrics.timer("PaymobAPI.create_payment_key")
     def create_payment_key(self, sales_order, paymob_order_id):
         """Create payment key for Paymob"""
-        token = self.get_auth_token()
-        
         url = f"{self.base_url}/acceptance/payment_keys"
         
         # Calculate total amount in cents
@@ -128,7 +144,6 @@ class PaymobAPI:
             integration_id = 16745
         
         payload = {
-            "auth_token": token,
             "amount_cents": str(total_amount),
             "expiration": 3600,  # 1 hour expiration
             "order_id": paymob_order_id,
@@ -153,7 +168,7 @@ class PaymobAPI:
         }
         
         try:
-            response = requests.post(url, json=payload, timeout=30)
+            response = self._post_with_auth(url, payload)
             if response.status_code not in [200, 201]:
                 try:
                     frappe.log_error(
@@ -174,11 +189,10 @@ class PaymobAPI:
             frappe.log_error(f"Paymob Payment Key Error: {str(e)}", "Paymob API Error")
             frappe.throw(_(f"Failed to create payment key in Paymob. Please try again. ({str(e)})"))
     
+    @metrics.timer("PaymobAPI.generate_payment_link")
     def generate_payment_link(self, sales_order):
         """Generate payment link for customer using Paymob Payment Link API"""
         try:
-            token = self.get_auth_token()
-            
             # Calculate total amount in cents
             total_amount = int(flt(sales_order.grand_total) * 100)
             
@@ -192,7 +206,6 @@ class PaymobAPI:
             url = f"{self.base_url}/acceptance/payment_keys"
             
             payload = {
-                "auth_token": token,
                 "amount_cents": str(total_amount),
                 "expiration": 3600,  # 1 hour expiration
                 "billing_data": {
@@ -216,7 +229,7 @@ class PaymobAPI:
             }
             
             try:
-                response = requests.post(url, json=payload, timeout=30)
+                response = self._post_with_auth(url, payload)
                 if response.status_code not in [200, 201]:
                     try:
                         error_body = response.text
@@ -252,122 +265,45 @@ class PaymobAPI:
             frappe.log_error(f"Generate Payment Link Error: {str(e)}", "Paymob API Error")
             frappe.throw(_("Failed to generate payment link. Please try again."))
     
+    @metrics.timer("PaymobAPI.send_whatsapp_message")
     def send_whatsapp_message(self, phone_number, message):
         """Send WhatsApp message using WAHA API"""
         try:
-            settings = frappe.get_single("Paymob Settings")
+            settings = self.settings
             
             if not getattr(settings, 'enable_whatsapp_notifications', False):
-                frappe.log_error("WhatsApp notifications are disabled", "WhatsApp Disabled")
                 return False
             
             waha_url = getattr(settings, 'waha_api_url', 'http://localhost:3000')
             session_name = getattr(settings, 'whatsapp_session_name', 'default')
             
-            # Clean phone number (remove + and spaces, ensure it starts with country code)
-            clean_phone = phone_number.replace('+', '').replace(' ', '').replace('-', '')
-            
-            # If phone doesn't start with country code, assume Saudi Arabia (+966)
-            if not clean_phone.startswith('966'):
-                clean_phone = '966' + clean_phone.lstrip('0')
-            
-            # WAHA API endpoint for sending messages
-            api_url = f"{waha_url}/api/sendText"
-            
-            payload = {
-                "chatId": f"{clean_phone}@c.us",
-                "text": message,
-                "session": session_name
-            }
+            api_url = whatsapp.send_text_url(waha_url)
+            payload = whatsapp.build_text_payload(phone_number, message, session_name)
             
             headers = {
                 "Content-Type": "application/json"
             }
             
-            response = requests.post(api_url, json=payload, headers=headers, timeout=30)
+            response = transport.post(api_url, json=payload, headers=headers, service="waha")
             
             if response.status_code in [200, 201]:
-                frappe.log_error(f"WhatsApp message sent successfully to {phone_number}", "WhatsApp Success")
+                metrics.incr("paymob_whatsapp_messages_total", status="ok")
                 return True
             else:
+                metrics.incr("paymob_whatsapp_messages_total", status="error")
                 frappe.log_error(f"WhatsApp API Error: {response.status_code} - {response.text}", "WhatsApp API Error")
                 return False
                 
         except Exception as e:
+            metrics.incr("paymob_whatsapp_messages_total", status="error")
             frappe.log_error(f"WhatsApp Send Error: {str(e)}", "WhatsApp Error")
             return False
 
+    @metrics.timer("PaymobAPI.send_payment_email")
     def send_payment_email(self, sales_order, payment_link):
         """Send payment link to customer via email"""
         try:
-            # Get customer email
-            customer_email = sales_order.contact_email
-            if not customer_email:
-                customer = frappe.get_doc("Customer", sales_order.customer)
-                customer_email = customer.email_id
-            
-            if not customer_email:
-                frappe.throw(_("Customer email not found. Please add email to customer or contact."))
-            
-            # Email template
-            subject = f"Payment Link for Sales Order {sales_order.name}"
-            
-            message = f"""
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-                <h2 style="color: #2c3e50;">Payment Request</h2>
-                <p>Dear {sales_order.customer_name or 'Valued Customer'},</p>
-                
-                <p>Thank you for your order. Please complete your payment using the link below:</p>
-                
-                <div style="background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin: 20px 0;">
-                    <h3>Order Details:</h3>
-                    <p><strong>Sales Order:</strong> {sales_order.name}</p>
-                    <p><strong>Total Amount:</strong> {sales_order.currency} {sales_order.grand_total}</p>
-                    <p><strong>Due Date:</strong> {sales_order.delivery_date or 'Not specified'}</p>
-                </div>
-                
-                <div style="text-align: center; margin: 30px 0;">
-                    <a href="{payment_link}" 
-                       style="background-color: #007bff; color: white; padding: 15px 30px; 
-                              text-decoration: none; border-radius: 5px; font-weight: bold;
-                              display: inline-block;">
-                        Pay Now
-                    </a>
-                </div>
-                
-                <p><strong>Note:</strong> This payment link will expire in 1 hour for security reasons.</p>
-                
-                <p>If you have any questions, please contact us.</p>
-                
-                <hr style="margin: 30px 0; border: none; border-top: 1px solid #eee;">
-                <p style="color: #666; font-size: 12px;">
-                    This is an automated message. Please do not reply to this email.
-                </p>
-            </div>
-            """
-            
-            # Send email
-            frappe.sendmail(
-                recipients=[customer_email],
-                subject=subject,
-                message=message,
-                header=["Payment Request", "green"]
-            )
-            
-            # Log email sent
-            frappe.get_doc({
-                "doctype": "Communication",
-                "communication_type": "Communication",
-                "communication_medium": "Email",
-                "sent_or_received": "Sent",
-                "email_status": "Open",
-                "subject": subject,
-                "content": message,
-                "reference_doctype": "Sales Order",
-                "reference_name": sales_order.name,
-                "sender": frappe.session.user,
-                "recipients": customer_email
-            }).insert(ignore_permissions=True)
+            payment_email.send_payment_email(sales_order.name, payment_link)
             
             frappe.msgprint(_("Payment link sent to customer successfully!"))
             
@@ -375,250 +311,146 @@ class PaymobAPI:
             frappe.log_error(f"Send Payment Email Error: {str(e)}", "Paymob Email Error")
             frappe.throw(_("Failed to send payment email. Please try again."))
     
-    def verify_webhook_signature(self, payload, signature):
-        """Verify webhook signature from Paymob"""
+    def verify_webhook_signature(self, webhook_data, signature, raw_body=None):
+        """Verify webhook signature from Paymob.
+
+        `signature` is Paymob's `hmac` query parameter (HMAC-SHA512 over the
+        documented transaction fields). When `raw_body` is given, the signature
+        is instead checked against the exact request body.
+        """
         try:
-            # Create expected signature
-            expected_signature = hmac.new(
-                self.hmac.encode('utf-8'),
-                payload.encode('utf-8'),
-                hashlib.sha256
-            ).hexdigest()
-            
-            return hmac.compare_digest(signature, expected_signature)
+            if raw_body is not None:
+                return verify_raw_body_hmac(raw_body, signature, self.hmac)
+            return verify_transaction_hmac(webhook_data.get("obj"), signature, self.hmac)
             
         except Exception as e:
             frappe.log_error(f"Webhook Signature Verification Error: {str(e)}", "Paymob Webhook Error")
             return False
     
+    @metrics.timer("PaymobAPI.process_payment_webhook")
     def process_payment_webhook(self, webhook_data):
         """Process payment webhook from Paymob"""
         try:
-            # Extract data from webhook
-            order_id = webhook_data.get("obj", {}).get("order", {}).get("merchant_order_id")
-            transaction_id = webhook_data.get("obj", {}).get("id")
-            amount = webhook_data.get("obj", {}).get("amount_cents", 0) / 100
-            currency = webhook_data.get("obj", {}).get("currency")
-            payment_status = webhook_data.get("obj", {}).get("success")
-            
-            if not order_id:
-                frappe.log_error("No order ID in webhook data", "Paymob Webhook Error")
-                return
-            
-            # Get Sales Order
-            sales_order = frappe.get_doc("Sales Order", order_id)
-            
-            if not sales_order:
-                frappe.log_error(f"Sales Order {order_id} not found", "Paymob Webhook Error")
+            txn = transaction_from_webhook(webhook_data)
+            if not txn:
                 return
             
-            # Update Sales Order with transaction details
-            sales_order.db_set("paymob_transaction_id", transaction_id)
-            sales_order.db_set("paymob_payment_status", "Paid" if payment_status else "Failed")
-            
-            if payment_status:
-                # Create Payment Entry
-                self.create_payment_entry(sales_order, amount, currency, transaction_id)
-                
-                # Update Sales Order status
-                if sales_order.docstatus == 1:  # Only if submitted
-                    sales_order.db_set("status", "Completed")
-                
+            if txn.success:
+                # Create Payment Entry and mark the Sales Order paid
+                self.create_payment_entry(
+                    txn.sales_order, txn.amount, txn.currency, txn.transaction_id,
+                    complete_order=txn.complete_order, source=txn.source,
+                    merchant_order_id=txn.merchant_order_id, paymob_order_id=txn.paymob_order_id
+                )
                 frappe.msgprint(_("Payment received and Payment Entry created successfully!"))
             else:
-                frappe.log_error(f"Payment failed for Sales Order {order_id}", "Paymob Payment Error")
+                record_failed_payment(txn)
+                frappe.log_error(f"Payment failed for Sales Order {txn.sales_order.name}", "Paymob Payment Error")
                 
         except Exception as e:
             frappe.log_error(f"Process Payment Webhook Error: {str(e)}", "Paymob Webhook Error")
+            # Let the caller release the transaction so Paymob's retry is processed again
+            raise
     
-    def create_payment_entry(self, sales_order, amount, currency, transaction_id):
-        """Create Payment Entry in ERPNext"""
-        try:
-            # Get company from Sales Order
-            company = sales_order.company
-            
-            # Get default payment account for the company
-            payment_account = frappe.get_value("Company", company, "default_receivable_account")
-            
-            if not payment_account:
-                frappe.throw(_("Default receivable account not found for company {0}").format(company))
-            
-            # Create Payment Entry
-            payment_entry = frappe.get_doc({
-                "doctype": "Payment Entry",
-                "payment_type": "Receive",
-                "party_type": "Customer",
-                "party": sales_order.customer,
-                "company": company,
-                "paid_amount": amount,
-                "received_amount": amount,
-                "reference_no": transaction_id,
-                "reference_date": now(),
-                "mode_of_payment": "Paymob",
-                "paid_to": payment_account,
-                "paid_to_account_currency": currency,
-                "source_exchange_rate": 1,
-                "target_exchange_rate": 1,
-                "references": [{
-                    "reference_doctype": "Sales Order",
-                    "reference_name": sales_order.name,
-                    "allocated_amount": amount
-                }]
-            })
-            
-            payment_entry.insert(ignore_permissions=True)
-            payment_entry.submit()
-            
-            # Link Payment Entry to Sales Order
-            sales_order.db_set("paymob_payment_entry", payment_entry.name)
-            
-            frappe.log_error(f"Payment Entry {payment_entry.name} created for Sales Order {sales_order.name}", "Paymob Payment Entry")
-            
-        except Exception as e:
-            frappe.log_error(f"Create Payment Entry Error: {str(e)}", "Paymob Payment Entry Error")
+    def create_payment_entry(self, sales_order, amount, currency, transaction_id, complete_order=False,
+                             source=None, merchant_order_id=None, paymob_order_id=None):
+        """Create Payment Entry in ERPNext and link it to the Sales Order"""
+        result = post_payment_entries([{
+            "sales_order": sales_order,
+            "amount": amount,
+            "currency": currency,
+            "transaction_id": transaction_id,
+            "complete_order": complete_order,
+            "source": source,
+            "merchant_order_id": merchant_order_id,
+            "paymob_order_id": paymob_order_id
+        }], commit=False)
+
+        if result["failed"]:
+            error = next(iter(result["failed"].values()))
+            frappe.log_error(f"Create Payment Entry Error: {error}", "Paymob Payment Entry Error")
             frappe.throw(_("Failed to create Payment Entry. Please check the logs."))
 
+        return next(iter(result["posted"].values()))
+
 
-@frappe.whitelist()
 @frappe.whitelist()
 def create_payment_link_v2(sales_order_name: str):
     """
     Creates a Paymob hosted payment link for a Sales Order and saves it in
-    Sales Order.custom_paymob_payment_link. Returns a dict with useful info.
+    Sales Order.paymob_payment_link. Returns a dict with useful info,
+    including per-step timings in milliseconds.
 
     Flow:
-      Step 1 - Authenticate (get AUTH_TOKEN)
-      Step 2 - Create Order (get Paymob ORDER_ID)
-      Step 3 - Create Payment Key (get PAYMENT_KEY)
-      Step 4 - Build iframe URL and save to Sales Order
+      Step 1 - Prefetch Sales Order, contact and address data (one query)
+      Step 2 - Authenticate (cached AUTH_TOKEN, shared across steps)
+      Step 3 - Create Order (get Paymob ORDER_ID)
+      Step 4 - Create Payment Key (get PAYMENT_KEY)
+      Step 5 - Build iframe URL and save all Paymob fields in one write
     """
-    # --- Load docs & settings
-    so = frappe.get_doc("Sales Order", sales_order_name)
-    settings = _get_settings()
+    return payment_link.create_payment_link(sales_order_name, _get_settings())
 
-    # Log settings for debugging
-    frappe.log_error(f"Paymob Settings: {settings}", "Paymob API Settings Debug")
-    # Log sales order for debugging
-    frappe.log_error(f"Sales Order: {so.name} - Grand Total: {so.grand_total}", "Paymob API Sales Order Debug")
-
-    # Basic validation
-    missing = []
-    for f in ("api_key", "integration_id", "iframe_id"):
-        if not getattr(settings, f, None):
-            missing.append(f)
-            # Log missing attributes for debugging
-            frappe.log_error(f"Missing attribute in Paymob Settings: {f}", "Paymob API Settings")
-    if missing:
-        frappe.throw(_("Missing in Paymob Settings: {0}").format(", ".join(missing)))
-
-    # Amount & currency
-    # Paymob expects integer "amount_cents"
-    if so.grand_total is None:
-        frappe.throw(_("Sales Order has no grand total."))
-    amount_cents = cint(round(float(so.grand_total) * 100))
-    if amount_cents <= 0:
-        frappe.throw(_("Amount must be > 0 to create a payment link."))
-
-    # currency = so.currency or "SAR"
-    currency = "SAR"
-
-    # -----------------------
-    # Step 1: AUTHENTICATE
-    # -----------------------
-    auth_url = f"{PAYMOB_BASE_URL}/api/auth/tokens"
-    auth_payload = {"api_key": settings.api_key}
-    auth_res = _post(auth_url, auth_payload)
-    auth_token = auth_res.get("token")
-    if not auth_token:
-        frappe.throw(_("Paymob did not return an auth token."))
-
-    # -----------------------
-    # Step 2: CREATE ORDER
-    # -----------------------
-    # Use existing merchant_order_id if available, otherwise generate new one
-    merchant_order_id = so.get("paymob_merchant_order_id")
-    if not merchant_order_id:
-        merchant_order_id = f"{so.name}-{random_string(6)}"
-        so.db_set("paymob_merchant_order_id", merchant_order_id)
-
-    order_url = f"{PAYMOB_BASE_URL}/api/ecommerce/orders"
-    order_payload = {
-        "auth_token": auth_token,
-        "delivery_needed": False,
-        "amount_cents": amount_cents,
-        "currency": currency,
-        "merchant_order_id": merchant_order_id,
-        "items": []
-    }
-    
-    # Log order creation for debugging
-    # frappe.log_error(f"Creating Paymob Order with payload: {order_payload}", "Paymob API Create Order Debug")
-    
-    try:
-        order_res = _post(order_url, order_payload)
-        paymob_order_id = order_res.get("id")
-        if not paymob_order_id:
-            frappe.throw(_("Paymob did not return an order id."))
-    except frappe.exceptions.ValidationError as e:
-        # Handle duplicate merchant_order_id error
-        if "duplicate" in str(e).lower():
-            # Generate new merchant_order_id and retry
-            merchant_order_id = f"{so.name}-{random_string(6)}"
-            so.db_set("paymob_merchant_order_id", merchant_order_id)
-            order_payload["merchant_order_id"] = merchant_order_id
-            
-            order_res = _post(order_url, order_payload)
-            paymob_order_id = order_res.get("id")
-            if not paymob_order_id:
-                frappe.throw(_("Paymob did not return an order id after retry."))
-        else:
-            # Re-raise other errors
-            raise
+@frappe.whitelist()
+def create_payment_links_bulk(sales_order_names):
+    """
+    Queue payment link creation for many Sales Orders (e.g. month-end runs).
+    Progress is published on the `paymob_bulk_links_progress` realtime event.
+    """
+    if isinstance(sales_order_names, str):
+        sales_order_names = frappe.parse_json(sales_order_names)
+
+    sales_order_names = [name for name in dict.fromkeys(sales_order_names or []) if name]
+    if not sales_order_names:
+        frappe.throw(_("Please select at least one Sales Order."))
+
+    frappe.has_permission("Sales Order", "write", throw=True)
 
-    # -----------------------
-    # Step 3: PAYMENT KEY
-    # -----------------------
-    payment_key_url = f"{PAYMOB_BASE_URL}/api/acceptance/payment_keys"
-    billing_data = _prepare_billing_data(so)
-    payment_key_payload = {
-        "auth_token": auth_token,
-        "amount_cents": amount_cents,
-        "currency": currency,
-        "order_id": paymob_order_id,
-        "integration_id": cint(settings.integration_id),
-        "expiration": 3600,
-        "billing_data": billing_data
+    job = frappe.enqueue(
+        'paymob_integration.paymob_integration.payment_link.create_payment_links_job',
+        queue='long',
+        timeout=3600,
+        sales_order_names=sales_order_names
+    )
+
+    return {
+        "status": "queued",
+        "job_id": job.id if job else None,
+        "count": len(sales_order_names)
     }
-    payment_key_res = _post(payment_key_url, payment_key_payload)
-    payment_token = payment_key_res.get("token")
-    if not payment_token:
-        frappe.throw(_("Paymob did not return a payment token."))
-
-    # -----------------------
-    # Step 4: BUILD URL & SAVE
-    # -----------------------
-    iframe_id = cint(settings.iframe_id)
-    pay_link = f"{PAYMOB_BASE_URL}/api/acceptance/iframes/{iframe_id}?payment_token={payment_token}"
-
-    # Save to custom field on Sales Order
-    so.db_set("paymob_payment_link", pay_link)
-    so.db_set("paymob_order_id", paymob_order_id)
-    so.add_comment("Info", _("Paymob payment link generated and saved."))
-    so.reload()
+
+@frappe.whitelist()
+def send_payment_emails_bulk(sales_order_names):
+    """
+    Queue payment link emails for many Sales Orders (e.g. dunning runs).
+    Orders without a payment link or customer email are skipped and logged.
+    """
+    if isinstance(sales_order_names, str):
+        sales_order_names = frappe.parse_json(sales_order_names)
+
+    sales_order_names = [name for name in dict.fromkeys(sales_order_names or []) if name]
+    if not sales_order_names:
+        frappe.throw(_("Please select at least one Sales Order."))
+
+    frappe.has_permission("Sales Order", "read", throw=True)
+
+    job = frappe.enqueue(
+        'paymob_integration.paymob_integration.payment_email.send_payment_emails_job',
+        queue='long',
+        timeout=3600,
+        sales_order_names=sales_order_names
+    )
 
     return {
-        "success": True,
-        "sales_order": so.name,
-        "amount_cents": amount_cents,
-        "currency": currency,
-        "paymob_order_id": paymob_order_id,
-        "payment_token": payment_token,
-        "payment_url": pay_link
+        "status": "queued",
+        "job_id": job.id if job else None,
+        "count": len(sales_order_names)
     }
-    
+
 @frappe.whitelist(allow_guest=True)
+@metrics.timer("paymob_webhook")
 def paymob_webhook():
     """Webhook endpoint for Paymob payment notifications"""
+    metrics.incr("paymob_webhooks_received_total")
     try:
         # Get webhook data
         webhook_data = frappe.request.get_json()
@@ -626,23 +458,48 @@ def paymob_webhook():
         if not webhook_data:
             frappe.throw(_("No webhook data received"))
         
-        # Get signature from headers
-        signature = frappe.request.headers.get("X-Paymob-Signature")
+        # Paymob sends the HMAC as a query parameter; a signed-body header is also accepted
+        signature = frappe.request.args.get("hmac")
+        raw_body = None
+        if not signature:
+            signature = frappe.request.headers.get("X-Paymob-Signature")
+            raw_body = frappe.request.get_data()
         
         if not signature:
-            frappe.throw(_("No signature in webhook headers"))
+            metrics.incr("paymob_webhook_signature_failures_total")
+            frappe.throw(_("No HMAC signature in webhook request"))
         
         # Initialize Paymob API
         paymob_api = PaymobAPI()
         
         # Verify signature
-        payload = json.dumps(webhook_data, separators=(',', ':'))
-        
-        if not paymob_api.verify_webhook_signature(payload, signature):
+        if not paymob_api.verify_webhook_signature(webhook_data, signature, raw_body):
+            metrics.incr("paymob_webhook_signature_failures_total")
             frappe.throw(_("Invalid webhook signature"))
         
+        # Paymob retries callbacks; acknowledge repeated deliveries without reprocessing
+        transaction_id = cstr((webhook_data.get("obj") or {}).get("id"))
+        queued = bool(transaction_id and cint(paymob_api.settings.get("queue_webhooks")))
+        raw_payload = frappe.request.get_data(as_text=True) if queued else None
+        if transaction_id and not webhook_dedup.claim_transaction(transaction_id, webhook_data, raw_payload):
+            metrics.incr("paymob_webhook_duplicates_total")
+            return {"status": "duplicate"}
+
+        if queued:
+            # The event is in the inbox; Payment Entries are posted by the inbox worker
+            webhook_queue.enqueue_inbox_drain()
+            return {"status": "queued"}
+
         # Process webhook
-        paymob_api.process_payment_webhook(webhook_data)
+        try:
+            paymob_api.process_payment_webhook(webhook_data)
+        except Exception as e:
+            if transaction_id:
+                webhook_dedup.release_transaction(transaction_id, str(e))
+            raise
+
+        if transaction_id:
+            webhook_dedup.mark_processed(transaction_id)
         
         return {"status": "success"}
         
@@ -682,15 +539,9 @@ def test_paymob_connection():
 def get_payment_status(sales_order_name):
     """Get payment status for Sales Order"""
     try:
-        sales_order = frappe.get_doc("Sales Order", sales_order_name)
-        
-        return {
-            "paymob_order_id": sales_order.get("paymob_order_id"),
-            "paymob_transaction_id": sales_order.get("paymob_transaction_id"),
-            "paymob_payment_status": sales_order.get("paymob_payment_status"),
-            "paymob_payment_link": sales_order.get("paymob_payment_link"),
-            "paymob_payment_entry": sales_order.get("paymob_payment_entry")
-        }
+        # Same cached read as get_payment_statuses, so both endpoints always agree
+        status = payment_status.get_statuses([sales_order_name]).get(sales_order_name)
+        return status or dict.fromkeys(payment_status.STATUS_FIELDS)
         
     except Exception as e:
         frappe.log_error(f"Get Payment Status Error: {str(e)}", "Paymob Status Error")
@@ -700,102 +551,64 @@ def get_payment_status(sales_order_name):
         }
 
 
+@frappe.whitelist(methods=["GET", "POST"])
+def get_payment_statuses(names):
+    """Get payment status for up to 1,000 Sales Orders in one call.
+
+    The response carries an ETag; pollers that send it back as
+    If-None-Match get an empty 304 while nothing has changed.
+    """
+    names = frappe.parse_json(names) if isinstance(names, str) else names
+    if isinstance(names, str):
+        names = names.split(",")
+    frappe.has_permission("Sales Order", "read", throw=True)
+
+    statuses = payment_status.get_statuses([cstr(name).strip() for name in names or []])
+    etag = payment_status.etag(statuses)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if payment_status.etag_matches(etag, frappe.get_request_header("If-None-Match")):
+        return Response(status=304, headers=headers)
+    return Response(frappe.as_json({"message": statuses}, indent=None), mimetype="application/json", headers=headers)
+
+
 # Custom Fields for Sales Order
 def add_custom_fields_to_sales_order():
     """Add custom fields to Sales Order for Paymob integration"""
-    custom_fields = [
-        {
-            "fieldname": "paymob_order_id",
-            "label": "Paymob Order ID",
-            "fieldtype": "Data",
-            "insert_after": "delivery_date",
-            "read_only": 1,
-            "allow_on_submit": 1
-        },
-            {
-                "fieldname": "paymob_merchant_order_id",
-                "label": "Paymob Merchant Order ID",
-                "fieldtype": "Data",
-                "insert_after": "paymob_order_id",
-                "read_only": 1,
-                "allow_on_submit": 1
-            },
-        {
-            "fieldname": "paymob_transaction_id",
-            "label": "Paymob Transaction ID", 
-            "fieldtype": "Data",
-                "insert_after": "paymob_merchant_order_id",
-            "read_only": 1,
-            "allow_on_submit": 1
-        },
-        {
-            "fieldname": "paymob_payment_status",
-            "label": "Paymob Payment Status",
-            "fieldtype": "Select",
-            "options": "Pending\nPaid\nFailed",
-            "insert_after": "paymob_transaction_id",
-            "read_only": 1,
-            "allow_on_submit": 1
-        },
-        {
-            "fieldname": "paymob_payment_link",
-            "label": "Paymob Payment Link",
-            "fieldtype": "Small Text",
-            "insert_after": "paymob_payment_status",
-            "read_only": 1,
-            "allow_on_submit": 1
-        },
-        {
-            "fieldname": "paymob_payment_entry",
-            "label": "Paymob Payment Entry",
-            "fieldtype": "Link",
-            "options": "Payment Entry",
-            "insert_after": "paymob_payment_link",
-            "read_only": 1,
-            "allow_on_submit": 1
-        }
-    ]
-    
-    for field in custom_fields:
-        if not frappe.get_value("Custom Field", {"dt": "Sales Order", "fieldname": field["fieldname"]}):
-            custom_field = frappe.get_doc({
-                "doctype": "Custom Field",
-                "dt": "Sales Order",
-                **field
-            })
-            custom_field.insert(ignore_permissions=True)
+    setup_custom_fields()
 
 
-# Initialize custom fields when module is installed
 def initialize_paymob_integration(doc, method=None):
-    """Initialize Paymob integration on Sales Order submit"""
+    """Initialize Paymob integration on Sales Order submit.
+
+    Runs before submit, so the initial status goes out with the submit's own
+    write and the follow-up jobs are only queued once it commits.
+    """
     try:
-        add_custom_fields_to_sales_order()
+        # Custom fields are provisioned on install/migrate; the cached meta tells us if that happened
+        if not frappe.get_meta("Sales Order").has_field("paymob_payment_status"):
+            return
+
         # Set initial payment status
-        doc.db_set("paymob_payment_status", "Pending")
+        doc.paymob_payment_status = "Pending"
         
         # Auto-create payment link if enabled in settings
-        settings = frappe.get_single("Paymob Settings")
-        if hasattr(settings, 'auto_create_payment_link') and settings.auto_create_payment_link:
+        settings = get_settings()
+        if settings.auto_create_payment_link:
             if doc.grand_total > 0:
                 frappe.enqueue(
-                    'paymob_integration.paymob_integration.api.create_payment_link',
+                    'paymob_integration.paymob_integration.api.create_payment_link_v2',
                     queue='short',
                     timeout=300,
+                    enqueue_after_commit=True,
                     sales_order_name=doc.name
                 )
                 frappe.msgprint(_("Payment link will be created and sent to customer automatically."))
         
         # Send WhatsApp message if enabled in settings
-        if hasattr(settings, 'enable_whatsapp_notifications') and settings.enable_whatsapp_notifications:
+        if settings.enable_whatsapp_notifications:
             phone_number = doc.contact_mobile or doc.contact_phone
             if phone_number:
-                frappe.enqueue(
-                    'paymob_integration.paymob_integration.api.send_whatsapp_message',
-                    queue='short',
-                    timeout=300,
-                    sales_order_name=doc.name
-                )
+                whatsapp_outbox.queue_message(phone_number, whatsapp.order_message(doc.name), sales_order=doc.name)
                 frappe.msgprint(_("WhatsApp notification will be sent to customer automatically."))
         
     except Exception as e:
@@ -858,7 +671,7 @@ def send_whatsapp_message(sales_order_name):
         if not phone_number:
             frappe.throw(_("Customer phone number not found. Please add phone number to contact."))
         
-        message = f"Thank you for your order with Sage Services! Order: {sales_order.name}"
+        message = whatsapp.order_message(sales_order.name)
         
         # Initialize Paymob API
         paymob_api = PaymobAPI()
@@ -886,65 +699,10 @@ def send_whatsapp_message(sales_order_name):
 
 
 
-# app/module/api/paymob.py  (for example)
-import requests
-import frappe
-from frappe import _
-from frappe.utils import cint
-
-PAYMOB_BASE_URL = "https://ksa.paymob.com"  # KSA environment
-
-def _post(url: str, json: dict, timeout=20):
-    try:
-        resp = requests.post(url, json=json, timeout=timeout)
-        # Paymob returns JSON even on many errors; raise for non-2xx
-        if not (200 <= resp.status_code < 300):
-            try:
-                details = resp.json()
-            except Exception:
-                details = resp.text
-            frappe.throw(_("Paymob API error at {0}: HTTP {1} - {2}")
-                         .format(url, resp.status_code, details))
-        return resp.json()
-    except requests.exceptions.RequestException as e:
-        frappe.throw(_("Network error calling Paymob: {0}").format(e))
-
-def _get_settings():
-    try:
-        return frappe.get_single("Paymob Settings")
-    except Exception:
-        frappe.throw(_("Please create a singleton doctype named 'Paymob Settings' "
-                       "with api_key, secret_key, public_key, integration_id, iframe_id."))
-
 def _prepare_billing_data(so):
     # Paymob requires all these keys. Use best-effort data from the SO; fall back to safe defaults.
-    email = getattr(so, "contact_email", None) or frappe.db.get_value("Contact", {"name": so.contact_person}, "email_id") or "customer@example.com"
-    phone = getattr(so, "contact_phone", None) or frappe.db.get_value("Contact", {"name": so.contact_person}, "phone") or "+966500000000"
-    first_name = (so.customer_name or "Customer").split(" ")[0][:50]
-    last_name = "Customer"
-    city = getattr(so, "shipping_address_name", None) and (frappe.db.get_value("Address", so.shipping_address_name, "city") or "Riyadh") or "Riyadh"
-    state = "Riyadh"
-    postal_code = getattr(so, "shipping_address_name", None) and (frappe.db.get_value("Address", so.shipping_address_name, "pincode") or "11564") or "11564"
-    street = getattr(so, "shipping_address_name", None) and (frappe.db.get_value("Address", so.shipping_address_name, "address_line1") or "King Fahd Rd") or "King Fahd Rd"
-    country_code = frappe.db.get_value("Address", so.shipping_address_name, "country") if getattr(so, "shipping_address_name", None) else "SA"
-    if country_code == "Saudi Arabia":
-        country_code = "SA"
-
-    return {
-        "apartment": "NA",
-        "email": email,
-        "floor": "NA",
-        "first_name": first_name,
-        "street": street or "King Fahd Rd",
-        "building": "10",
-        "phone_number": phone,
-        "shipping_method": "PKG",
-        "postal_code": postal_code or "11564",
-        "city": city or "Riyadh",
-        "country": country_code or "SA",
-        "last_name": last_name,
-        "state": state or "Riyadh"
-    }
+    row = payment_link.fetch_billing_rows([so.name]).get(so.name) or frappe._dict(name=so.name)
+    return payment_link.billing_data(row)
 
 # your_app/your_module/api/paymob.py
 
@@ -958,30 +716,26 @@ from frappe.utils.data import flt, cint
 from erpnext.accounts.party import get_party_account
 from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
 
-PAYMOB_BASE_URL = "https://ksa.paymob.com"
-
-def _post(url: str, json_payload: dict, timeout=20):
+def _post(url: str, json_payload: dict, timeout=None):
     """Small wrapper that returns JSON or throws a friendly ERPNext error."""
     try:
-        resp = requests.post(url, json=json_payload, timeout=timeout)
-        if not (200 <= resp.status_code < 300):
-            try:
-                details = resp.json()
-            except Exception:
-                details = resp.text
-            frappe.throw(_("Paymob API error at {0}: HTTP {1} - {2}")
-                         .format(url, resp.status_code, details))
-        return resp.json()
+        resp = transport.post(url, json=json_payload, timeout=timeout)
     except requests.exceptions.RequestException as e:
         frappe.throw(_("Network error calling Paymob: {0}").format(e))
+    return transport.json_or_throw(url, resp)
+
+def _authed_post(url: str, json_payload: dict, settings, timeout=None):
+    """Like `_post`, but adds a cached auth token and re-authenticates once on HTTP 401."""
+    return authed_post(url, json_payload, settings.api_key, timeout=timeout)
 
 def _get_settings():
     try:
-        return frappe.get_single("Paymob Settings")
+        return get_settings()
     except Exception:
         frappe.throw(_("Please create the singleton 'Paymob Settings' with api_key, secret_key, public_key, integration_id, iframe_id."))
 
 @frappe.whitelist()
+@metrics.timer("inquire_and_create_payment_entry")
 def inquire_and_create_payment_entry(sales_order_name: str):
     """
     Button action:
@@ -992,13 +746,10 @@ def inquire_and_create_payment_entry(sales_order_name: str):
     so = frappe.get_doc("Sales Order", sales_order_name)
     settings = _get_settings()
 
-    # Step 1: Authenticate
-    auth_token = _get_auth_token(settings)
-
-    # Step 2: Inquiry request
+    # Step 1 + 2: Inquiry request with a cached auth token
     inquiry_url = f"{PAYMOB_BASE_URL}/api/ecommerce/orders/transaction_inquiry"
-    payload = {"auth_token": auth_token, "order_id": so.paymob_order_id}
-    res = _post(inquiry_url, payload)
+    payload = {"order_id": so.paymob_order_id}
+    res = _authed_post(inquiry_url, payload, settings)
 
     # Step 3: Validate transaction success
     pending = res.get("pending")
@@ -1031,38 +782,30 @@ def inquire_and_create_payment_entry(sales_order_name: str):
                 "transaction": res,
             }
 
-        # Create and submit new Payment Entry
-        pe = get_payment_entry("Sales Order", so.name)
-        pe.paid_amount = amount
-        pe.received_amount = amount
-        pe.reference_no = str(res.get("transaction_no") or res.get("receipt_no") or "Paymob")
-        pe.reference_date = nowdate()
-
-        if not pe.paid_to:
-            default_bank = frappe.get_cached_value("Company", so.company, "default_bank_account")
-            if not default_bank:
-                frappe.throw(_("Please set a Default Bank Account in Company master or set Paid To manually."))
-            pe.paid_to = default_bank
-
-        pe.insert(ignore_permissions=True)
-        pe.submit()
-
-        # Mark Sales Order
-        try:
-            so.db_set("custom_paymob_status", "Paid")
-        except Exception:
-            pass
+        # Create and submit new Payment Entry, marking the Sales Order paid
+        result = post_payment_entries([{
+            "sales_order": so,
+            "amount": amount,
+            "currency": currency,
+            "transaction_id": str(res.get("id") or res.get("transaction_no") or res.get("receipt_no") or "Paymob"),
+            "source": "Inquiry",
+            "merchant_order_id": so.get("paymob_merchant_order_id"),
+            "paymob_order_id": so.get("paymob_order_id"),
+        }], commit=False)
+        if result["failed"]:
+            frappe.throw(next(iter(result["failed"].values())))
+        payment_entry = next(iter(result["posted"].values()))
 
         so.add_comment(
             "Info",
             _("💳 Paymob payment successful. Amount: {0} {1}. Payment Entry: {2}")
-            .format(f"{amount:.2f}", currency, pe.name),
+            .format(f"{amount:.2f}", currency, payment_entry),
         )
 
         return {
             "success": True,
             "status": "PAID",
-            "payment_entry": pe.name,
+            "payment_entry": payment_entry,
             "amount": amount,
             "currency": currency,
             "transaction": res,
@@ -1074,23 +817,7 @@ def inquire_and_create_payment_entry(sales_order_name: str):
 
 def _get_auth_token(settings):
     """
-    Obtain a fresh Paymob authentication token.
+    Obtain a Paymob authentication token from the shared token cache.
     Returns: auth_token (str)
     """
-    url = f"{PAYMOB_BASE_URL}/api/auth/tokens"
-    payload = {"api_key": settings.api_key}
-    try:
-        resp = requests.post(url, json=payload, timeout=20)
-        if resp.status_code != 201 and resp.status_code != 200:
-            try:
-                detail = resp.json()
-            except Exception:
-                detail = resp.text
-            frappe.throw(_("Paymob auth failed: {0}").format(detail))
-        data = resp.json()
-        token = data.get("token")
-        if not token:
-            frappe.throw(_("Paymob auth response did not include a token."))
-        return token
-    except requests.exceptions.RequestException as e:
-        frappe.throw(_("Error connecting to Paymob Auth API: {0}").format(e))
+    return get_auth_token(settings.api_key)
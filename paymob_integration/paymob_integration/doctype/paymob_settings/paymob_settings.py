@@ -4,6 +4,9 @@
 # import frappe
 from frappe.model.document import Document
 
+from paymob_integration.paymob_integration.settings import clear_settings_cache
+
 
 class PaymobSettings(Document):
-	pass
+	def on_update(self):
+		clear_settings_cache()
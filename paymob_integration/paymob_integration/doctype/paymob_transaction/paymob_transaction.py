@@ -0,0 +1,18 @@
+# Copyright (c) 2026, Sarmad and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+
+class PaymobTransaction(Document):
+	def validate(self):
+		# The ledger is append-only: every attempt and callback gets its own row
+		if not self.is_new():
+			frappe.throw(_("Paymob Transactions cannot be changed"))
+
+
+def on_doctype_update():
+	frappe.db.add_index("Paymob Transaction", ["status", "modified"])
+	frappe.db.add_index("Paymob Transaction", ["sales_order", "creation"])
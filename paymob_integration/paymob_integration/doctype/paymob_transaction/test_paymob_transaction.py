@@ -0,0 +1,47 @@
+# Copyright (c) 2026, Sarmad and Contributors
+# See license.txt
+
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, now_datetime
+
+from paymob_integration.paymob_integration import transactions
+
+
+class TestPaymobTransaction(FrappeTestCase):
+	def test_latest_row_is_the_current_state(self):
+		sales_order = "SO-TEST-" + frappe.generate_hash(length=8)
+		transactions.record([{"sales_order": sales_order, "status": "Pending", "paymob_order_id": 1}])
+		time.sleep(0.01)
+		transactions.record([{"sales_order": sales_order, "status": "Paid", "transaction_id": 2}])
+
+		self.assertEqual(transactions.latest([sales_order])[sales_order].status, "Paid")
+		self.assertEqual(len(transactions.history(sales_order)), 2)
+
+		since = add_days(now_datetime(), -1)
+		self.assertNotIn(sales_order, [row.sales_order for row in transactions.pending(since, limit=1000)])
+
+	def test_rows_of_one_call_keep_their_order(self):
+		sales_order = "SO-TEST-" + frappe.generate_hash(length=8)
+		transactions.record(
+			[
+				{"sales_order": sales_order, "status": "Pending", "paymob_order_id": 1},
+				{"sales_order": sales_order, "status": "Paid", "transaction_id": 2},
+			]
+		)
+
+		self.assertEqual(transactions.latest([sales_order])[sales_order].status, "Paid")
+		self.assertEqual([row.status for row in transactions.history(sales_order)], ["Paid", "Pending"])
+
+		since = add_days(now_datetime(), -1)
+		self.assertNotIn(sales_order, [row.sales_order for row in transactions.pending(since, limit=1000)])
+
+	def test_rows_are_append_only(self):
+		transactions.record(
+			[{"sales_order": "SO-TEST-" + frappe.generate_hash(length=8), "status": "Pending"}]
+		)
+		doc = frappe.get_last_doc("Paymob Transaction")
+		doc.status = "Paid"
+		self.assertRaises(frappe.ValidationError, doc.save)
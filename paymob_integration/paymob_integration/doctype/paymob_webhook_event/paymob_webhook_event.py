@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Sarmad and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class PaymobWebhookEvent(Document):
+	pass
+
+
+def on_doctype_update():
+	# The inbox worker and the retention job pick events by status and age
+	frappe.db.add_index("Paymob Webhook Event", ["status", "creation"])
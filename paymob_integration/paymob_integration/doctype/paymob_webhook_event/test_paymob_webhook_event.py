@@ -0,0 +1,90 @@
+# Copyright (c) 2026, Sarmad and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from paymob_integration.paymob_integration.webhook_dedup import (
+	_redis_key,
+	claim_transaction,
+	mark_processed,
+	release_transaction,
+)
+from paymob_integration.paymob_integration.webhook_queue import (
+	LEASE_SECONDS,
+	PROCESSED_RETENTION_DAYS,
+	clear_processed_events,
+	requeue_stale_events,
+)
+
+
+def make_webhook(transaction_id):
+	return {
+		"obj": {"id": transaction_id, "success": True, "order": {"id": 1, "merchant_order_id": "SO-TEST"}}
+	}
+
+
+class TestPaymobWebhookEvent(FrappeTestCase):
+	def test_duplicate_delivery_is_claimed_once(self):
+		transaction_id = frappe.generate_hash(length=12)
+		self.assertTrue(claim_transaction(transaction_id, make_webhook(transaction_id)))
+		self.assertFalse(claim_transaction(transaction_id, make_webhook(transaction_id)))
+
+	def test_log_table_dedups_when_redis_lost_the_key(self):
+		transaction_id = frappe.generate_hash(length=12)
+		self.assertTrue(claim_transaction(transaction_id, make_webhook(transaction_id)))
+		mark_processed(transaction_id)
+
+		frappe.cache().delete(_redis_key(transaction_id))
+		self.assertFalse(claim_transaction(transaction_id, make_webhook(transaction_id)))
+
+	def test_released_transaction_is_processed_again(self):
+		transaction_id = frappe.generate_hash(length=12)
+		self.assertTrue(claim_transaction(transaction_id, make_webhook(transaction_id)))
+		release_transaction(transaction_id, "boom")
+
+		self.assertEqual(frappe.db.get_value("Paymob Webhook Event", transaction_id, "status"), "Failed")
+		self.assertTrue(claim_transaction(transaction_id, make_webhook(transaction_id)))
+
+	def test_stale_processing_event_is_requeued(self):
+		stale, fresh = frappe.generate_hash(length=12), frappe.generate_hash(length=12)
+		for transaction_id, claimed_at in [
+			(stale, add_to_date(now_datetime(), seconds=-LEASE_SECONDS - 60)),
+			(fresh, now_datetime()),
+		]:
+			frappe.get_doc(
+				{
+					"doctype": "Paymob Webhook Event",
+					"transaction_id": transaction_id,
+					"status": "Processing",
+					"claimed_at": claimed_at,
+					"payload": frappe.as_json(make_webhook(transaction_id)),
+				}
+			).insert(ignore_permissions=True)
+
+		requeue_stale_events()
+
+		self.assertEqual(
+			frappe.db.get_value("Paymob Webhook Event", stale, ["status", "attempts"]), ("Queued", 1)
+		)
+		self.assertEqual(frappe.db.get_value("Paymob Webhook Event", fresh, "status"), "Processing")
+
+	def test_old_processed_events_are_cleared(self):
+		processed, queued = frappe.generate_hash(length=12), frappe.generate_hash(length=12)
+		for transaction_id, status in [(processed, "Processed"), (queued, "Queued")]:
+			frappe.get_doc(
+				{"doctype": "Paymob Webhook Event", "transaction_id": transaction_id, "status": status}
+			).insert(ignore_permissions=True)
+			frappe.db.set_value(
+				"Paymob Webhook Event",
+				transaction_id,
+				"creation",
+				add_to_date(now_datetime(), days=-PROCESSED_RETENTION_DAYS - 1),
+				update_modified=False,
+			)
+
+		clear_processed_events()
+
+		self.assertFalse(frappe.db.exists("Paymob Webhook Event", processed))
+		self.assertTrue(frappe.db.exists("Paymob Webhook Event", queued))
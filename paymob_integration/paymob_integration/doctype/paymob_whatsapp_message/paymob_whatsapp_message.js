@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Sarmad and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Paymob WhatsApp Message", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Sarmad and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class PaymobWhatsAppMessage(Document):
+	pass
+
+
+def on_doctype_update():
+	# The outbox worker picks due messages by status and time
+	frappe.db.add_index("Paymob WhatsApp Message", ["status", "next_attempt_at"])
@@ -0,0 +1,50 @@
+# Copyright (c) 2026, Sarmad and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from paymob_integration.paymob_integration.whatsapp_outbox import (
+	MAX_ATTEMPTS,
+	_retry_values,
+	queue_message,
+	requeue_stale_messages,
+)
+
+
+class TestPaymobWhatsAppMessage(FrappeTestCase):
+	def test_queued_message_is_due_immediately(self):
+		phone_number = "05" + frappe.generate_hash(length=8)
+		queue_message(phone_number, "Hello")
+
+		message = frappe.get_last_doc("Paymob WhatsApp Message", filters={"phone_number": phone_number})
+		self.assertEqual(message.status, "Queued")
+		self.assertLessEqual(message.next_attempt_at, frappe.utils.now_datetime())
+
+	def test_failed_send_is_retried_then_given_up(self):
+		retry = _retry_values(frappe._dict(attempts=0), "boom")
+		self.assertEqual(retry["status"], "Queued")
+		self.assertEqual(retry["attempts"], 1)
+		self.assertGreater(retry["next_attempt_at"], frappe.utils.now_datetime())
+
+		given_up = _retry_values(frappe._dict(attempts=MAX_ATTEMPTS - 1), "boom")
+		self.assertEqual(given_up["status"], "Failed")
+
+	def test_stale_sending_message_is_retried(self):
+		phone_number = "05" + frappe.generate_hash(length=8)
+		queue_message(phone_number, "Hello")
+		name = frappe.db.get_value("Paymob WhatsApp Message", {"phone_number": phone_number})
+		frappe.db.set_value(
+			"Paymob WhatsApp Message",
+			name,
+			{
+				"status": "Sending",
+				"next_attempt_at": frappe.utils.add_to_date(frappe.utils.now_datetime(), minutes=-1),
+			},
+		)
+
+		requeue_stale_messages()
+
+		self.assertEqual(
+			frappe.db.get_value("Paymob WhatsApp Message", name, ["status", "attempts"]), ("Queued", 1)
+		)
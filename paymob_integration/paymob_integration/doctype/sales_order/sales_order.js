@@ -14,6 +14,20 @@ frappe.ui.form.on('Sales Order', {
     }
 });
 
+// Payment status changes are pushed to the open form's document room
+frappe.realtime.on('paymob_payment_status', function (data) {
+    if (!cur_frm || cur_frm.doctype !== 'Sales Order' || cur_frm.doc.name !== data.sales_order) {
+        return;
+    }
+
+    const indicators = { Paid: 'green', Failed: 'red' };
+    frappe.show_alert({
+        message: __('Paymob payment status: {0}', [__(data.status)]),
+        indicator: indicators[data.status] || 'blue'
+    });
+    cur_frm.reload_doc();
+});
+
 function add_paymob_buttons(frm) {
     // Add Create Payment Link button
     if (!frm.doc.paymob_payment_link) {
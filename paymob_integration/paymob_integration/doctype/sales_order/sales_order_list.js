@@ -0,0 +1,93 @@
+// Sales Order List View additions for Paymob Integration
+
+(function () {
+    const settings = frappe.listview_settings['Sales Order'] = frappe.listview_settings['Sales Order'] || {};
+    const base_onload = settings.onload;
+
+    settings.onload = function (listview) {
+        if (base_onload) {
+            base_onload(listview);
+        }
+
+        listview.page.add_action_item(__('Create Paymob Payment Links'), function () {
+            create_payment_links_bulk(listview);
+        });
+
+        listview.page.add_action_item(__('Send Paymob Payment Emails'), function () {
+            send_payment_emails_bulk(listview);
+        });
+    };
+})();
+
+function create_payment_links_bulk(listview) {
+    const names = listview.get_checked_items(true);
+    if (!names.length) {
+        frappe.msgprint(__('Please select at least one Sales Order.'));
+        return;
+    }
+
+    frappe.confirm(
+        __('Create Paymob payment links for {0} Sales Orders?', [names.length]),
+        function () {
+            frappe.call({
+                method: 'paymob_integration.paymob_integration.api.create_payment_links_bulk',
+                args: {
+                    sales_order_names: names
+                },
+                callback: function (r) {
+                    if (r.message && r.message.status === 'queued') {
+                        frappe.show_alert({
+                            message: __('Creating {0} payment links in the background...', [r.message.count]),
+                            indicator: 'blue'
+                        });
+                    }
+                }
+            });
+        }
+    );
+}
+
+function send_payment_emails_bulk(listview) {
+    const names = listview.get_checked_items(true);
+    if (!names.length) {
+        frappe.msgprint(__('Please select at least one Sales Order.'));
+        return;
+    }
+
+    frappe.confirm(
+        __('Email Paymob payment links for {0} Sales Orders?', [names.length]),
+        function () {
+            frappe.call({
+                method: 'paymob_integration.paymob_integration.api.send_payment_emails_bulk',
+                args: {
+                    sales_order_names: names
+                },
+                callback: function (r) {
+                    if (r.message && r.message.status === 'queued') {
+                        frappe.show_alert({
+                            message: __('Queueing {0} payment emails in the background...', [r.message.count]),
+                            indicator: 'blue'
+                        });
+                    }
+                }
+            });
+        }
+    );
+}
+
+frappe.realtime.on('paymob_bulk_links_progress', function (data) {
+    frappe.show_progress(__('Creating Paymob Payment Links'), data.done, data.total,
+        __('{0} created, {1} failed', [data.created, data.failed]));
+
+    if (data.finished) {
+        frappe.hide_progress();
+        frappe.msgprint({
+            title: __('Paymob Payment Links'),
+            message: __('{0} of {1} payment links created, {2} failed.', [data.created, data.total, data.failed]),
+            indicator: data.failed ? 'orange' : 'green'
+        });
+        if (cur_list && cur_list.doctype === 'Sales Order') {
+            cur_list.refresh();
+        }
+    }
+});
@@ -0,0 +1,141 @@
+"""Counters and latency histograms for the Paymob integration, shared by all workers.
+
+Values live in two Redis hashes per site and are only ever changed with
+HINCRBY/HINCRBYFLOAT, so web and background workers can all record
+without coordination. Each field is already a Prometheus sample
+(`name{labels}`), which keeps the scrape a plain HGETALL.
+"""
+
+import time
+from contextlib import contextmanager
+
+import frappe
+from werkzeug.wrappers import Response
+
+from paymob_integration.paymob_integration.tracing import LATENCY_BUCKETS
+
+COUNTERS = {
+	"paymob_links_created_total": "Payment links created",
+	"paymob_link_cache_total": "Payment link requests by link cache result (hit, refresh, miss)",
+	"paymob_webhooks_received_total": "Webhook deliveries received",
+	"paymob_webhook_duplicates_total": "Repeated webhook deliveries that were acknowledged without processing",
+	"paymob_webhook_signature_failures_total": "Webhooks rejected for a missing or invalid HMAC",
+	"paymob_payment_entries_posted_total": "Payment Entries posted for Paymob transactions",
+	"paymob_payment_entries_failed_total": "Paymob transactions whose Payment Entry could not be posted",
+	"paymob_payment_emails_queued_total": "Payment emails handed to the email queue",
+	"paymob_whatsapp_messages_total": "WhatsApp messages handed to WAHA, by outcome",
+	"paymob_rate_limit_rejections_total": "Calls refused because the rate limit queue for their family was full",
+	"paymob_span_retries_total": "Paymob/WAHA calls that were retries of an earlier attempt",
+}
+
+HISTOGRAMS = {
+	"paymob_operation_seconds": "Duration of Paymob API operations, the webhook and background jobs",
+	"paymob_span_seconds": "Duration of Paymob/WAHA calls and DB steps",
+	"paymob_rate_limit_wait_seconds": "Time outbound Paymob calls waited for the shared rate limit",
+}
+
+COUNTERS_KEY = "paymob:metrics:counters"
+HISTOGRAMS_KEY = "paymob:metrics:histograms"
+
+
+def incr(name, value=1, **labels):
+	"""Add `value` to a counter"""
+	try:
+		frappe.cache().hincrby(frappe.cache().make_key(COUNTERS_KEY), _sample(name, labels), value)
+	except Exception:
+		# Metrics must never break a payment
+		pass
+
+
+def observe(name, seconds, **labels):
+	"""Record one duration in a histogram, in a single Redis round trip"""
+	try:
+		key = frappe.cache().make_key(HISTOGRAMS_KEY)
+		pipe = frappe.cache().pipeline(transaction=False)
+		# Buckets are stored cumulatively, as Prometheus reports them
+		for bound in LATENCY_BUCKETS:
+			if seconds <= bound:
+				pipe.hincrby(key, _sample(f"{name}_bucket", {**labels, "le": bound}), 1)
+		pipe.hincrby(key, _sample(f"{name}_bucket", {**labels, "le": "+Inf"}), 1)
+		pipe.hincrbyfloat(key, _sample(f"{name}_sum", labels), seconds)
+		pipe.hincrby(key, _sample(f"{name}_count", labels), 1)
+		pipe.execute()
+	except Exception:
+		pass
+
+
+@contextmanager
+def timer(operation):
+	"""Observe the duration of an operation, labelled with whether it raised"""
+	started = time.perf_counter()
+	status = "ok"
+	try:
+		yield
+	except BaseException:
+		status = "error"
+		raise
+	finally:
+		observe("paymob_operation_seconds", time.perf_counter() - started, operation=operation, status=status)
+
+
+class RedisSpanSink:
+	"""Tracing sink that folds every span into the shared `paymob_span_seconds` histogram"""
+
+	def record(self, span):
+		observe(
+			"paymob_span_seconds", span.duration_ms / 1000, span=span.name, kind=span.kind, status=span.status
+		)
+		if span.retries:
+			incr("paymob_span_retries_total", span=span.name, kind=span.kind)
+
+
+def render():
+	"""All metrics of this site in Prometheus text format"""
+	cache = frappe.cache()
+	counters = cache.hgetall(cache.make_key(COUNTERS_KEY))
+	histograms = cache.hgetall(cache.make_key(HISTOGRAMS_KEY))
+
+	lines = []
+	for families, samples, metric_type in (
+		(COUNTERS, counters, "counter"),
+		(HISTOGRAMS, histograms, "histogram"),
+	):
+		samples = {frappe.safe_decode(field): frappe.safe_decode(value) for field, value in samples.items()}
+		for family, help_text in families.items():
+			lines.append(f"# HELP {family} {help_text}")
+			lines.append(f"# TYPE {family} {metric_type}")
+			lines.extend(
+				f"{field} {value}"
+				for field, value in sorted(samples.items(), key=_sort_key)
+				if field.split("{", 1)[0] in (family, f"{family}_bucket", f"{family}_sum", f"{family}_count")
+			)
+	return "\n".join(lines) + "\n"
+
+
+def _sample(name, labels):
+	if not labels:
+		return name
+	# `le` goes last so a series' buckets share everything before it
+	ordered = sorted(labels.items(), key=lambda item: (item[0] == "le", item[0]))
+	rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in ordered)
+	return f"{name}{{{rendered}}}"
+
+
+def _sort_key(item):
+	# Keep each series together and its buckets in ascending `le` order
+	series, _sep, bound = item[0].partition(',le="')
+	if not bound:
+		series, _sep, bound = item[0].partition('le="')
+	bound = bound.split('"', 1)[0]
+	return series, float("inf") if bound == "+Inf" else float(bound or 0)
+
+
+def _escape(value):
+	return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@frappe.whitelist()
+def prometheus():
+	"""Prometheus scrape endpoint, aggregated across all workers of the site"""
+	frappe.only_for("System Manager")
+	return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,163 @@
+import time
+
+import frappe
+from frappe import _
+from frappe.email.doctype.email_queue.email_queue import QueueBuilder
+
+from paymob_integration.paymob_integration import metrics, tracing
+
+TEMPLATE = "paymob_integration/templates/emails/paymob_payment_request.html"
+HEADER = ["Payment Request", "green"]
+
+# Orders per commit
+EMAIL_CHUNK_SIZE = 500
+
+
+def fetch_email_rows(sales_order_names):
+	"""Load the email fields of many Sales Orders, with the customer's email as fallback, in one query.
+
+	Returns a dict of Sales Order name -> row.
+	"""
+	if not sales_order_names:
+		return {}
+
+	rows = frappe.db.sql(
+		"""
+        select
+            so.name, so.docstatus, so.customer, so.customer_name, so.currency, so.grand_total,
+            so.delivery_date, so.contact_email, so.paymob_payment_link,
+            customer.email_id as customer_email
+        from `tabSales Order` so
+        left join `tabCustomer` customer on customer.name = so.customer
+        where so.name in %(names)s
+        """,
+		{"names": tuple(sales_order_names)},
+		as_dict=True,
+	)
+	return {row.name: row for row in rows}
+
+
+def recipient(row):
+	return row.get("contact_email") or row.get("customer_email")
+
+
+def get_subject(row):
+	return f"Payment Link for Sales Order {row.name}"
+
+
+def render_message(template, row):
+	return template.render({**row, "payment_link": row.paymob_payment_link})
+
+
+def queue_payment_emails(rows, template=None):
+	"""Render and queue payment emails for `fetch_email_rows` rows with a link and a recipient.
+
+	The template is compiled once. Each email is logged as a Communication
+	on the Sales Order, so its hooks and timeline links apply, and queued
+	through `QueueBuilder`. Mail goes out with the regular email queue
+	flush. Returns the names of the Sales Orders whose email was queued;
+	unsubscribed recipients are skipped.
+	"""
+	template = template or frappe.get_template(TEMPLATE)
+
+	queued = []
+	with tracing.span("payment_email.queue"):
+		for row in rows:
+			subject = get_subject(row)
+			message = render_message(template, row)
+
+			# Skip unsubscribed recipients before anything is logged for them
+			recipients = _queue_builder(row, subject, message).final_recipients()
+			if not recipients:
+				continue
+
+			communication = frappe.get_doc(
+				{
+					"doctype": "Communication",
+					"communication_type": "Communication",
+					"communication_medium": "Email",
+					"sent_or_received": "Sent",
+					"subject": subject,
+					"content": message,
+					"reference_doctype": "Sales Order",
+					"reference_name": row.name,
+					"sender": frappe.session.user,
+					"recipients": ", ".join(recipients),
+				}
+			).insert(ignore_permissions=True)
+			_queue_builder(row, subject, message, communication.name).process()
+			queued.append(row.name)
+
+	metrics.incr("paymob_payment_emails_queued_total", len(queued))
+	return queued
+
+
+def _queue_builder(row, subject, message, communication=None):
+	return QueueBuilder(
+		recipients=[recipient(row)],
+		subject=subject,
+		message=message,
+		header=HEADER,
+		reference_doctype="Sales Order",
+		reference_name=row.name,
+		communication=communication,
+	)
+
+
+def send_payment_email(sales_order_name, payment_link=None):
+	"""Queue the payment email of one Sales Order through the batch path"""
+	row = fetch_email_rows([sales_order_name]).get(sales_order_name)
+	if not row:
+		frappe.throw(_("Sales Order {0} not found").format(sales_order_name))
+	if payment_link:
+		row.paymob_payment_link = payment_link
+	if not row.paymob_payment_link:
+		frappe.throw(_("No payment link found. Please create payment link first."))
+	if not recipient(row):
+		frappe.throw(_("Customer email not found. Please add email to customer or contact."))
+
+	if not queue_payment_emails([row]):
+		frappe.throw(_("{0} has unsubscribed from emails.").format(recipient(row)))
+
+
+@metrics.timer("send_payment_emails_job")
+def send_payment_emails_job(sales_order_names, chunk_size=EMAIL_CHUNK_SIZE):
+	"""Background job behind `send_payment_emails_bulk`, e.g. for dunning runs"""
+	names = list(dict.fromkeys(sales_order_names))
+	rows = fetch_email_rows(names)
+	failed = {}
+	pending = []
+	for name in names:
+		row = rows.get(name)
+		if not row:
+			failed[name] = _("Sales Order not found")
+		elif not row.paymob_payment_link:
+			failed[name] = _("No payment link found")
+		elif not recipient(row):
+			failed[name] = _("Customer email not found")
+		else:
+			pending.append(row)
+
+	started = time.perf_counter()
+	template = frappe.get_template(TEMPLATE)
+	queued = 0
+	for i in range(0, len(pending), chunk_size):
+		chunk = pending[i : i + chunk_size]
+		queued_names = set(queue_payment_emails(chunk, template))
+		frappe.db.commit()
+		queued += len(queued_names)
+		failed.update(
+			{row.name: _("Recipient has unsubscribed") for row in chunk if row.name not in queued_names}
+		)
+
+	if failed:
+		frappe.log_error(
+			f"Paymob payment emails: {len(failed)} of {len(names)} not sent\n{frappe.as_json(failed)}",
+			"Paymob Payment Emails",
+		)
+	return {
+		"total": len(names),
+		"queued": queued,
+		"failed": failed,
+		"seconds": round(time.perf_counter() - started, 2),
+	}
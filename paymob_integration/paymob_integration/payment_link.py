@@ -0,0 +1,503 @@
+import base64
+import hashlib
+import hmac
+import time
+from concurrent.futures import as_completed
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, get_url, random_string, strip_html
+from frappe.utils.password import get_encryption_key
+
+from paymob_integration.paymob_integration import metrics, tracing, transactions
+from paymob_integration.paymob_integration.resolver import remember_order_ids
+from paymob_integration.paymob_integration.settings import get_settings
+from paymob_integration.paymob_integration.token_cache import authed_post, get_auth_token
+from paymob_integration.paymob_integration.transport import PAYMOB_BASE_URL, site_executor
+
+ORDER_URL = f"{PAYMOB_BASE_URL}/api/ecommerce/orders"
+PAYMENT_KEY_URL = f"{PAYMOB_BASE_URL}/api/acceptance/payment_keys"
+
+# Links are always created in SAR, whatever the Sales Order currency
+CURRENCY = "SAR"
+# Default lifetime of a payment key in seconds, see Paymob Settings
+PAYMENT_KEY_EXPIRATION = 3600
+
+# Paymob orders are reused for this long while the Sales Order is unchanged
+LINK_CACHE_TTL = 7 * 24 * 60 * 60
+# Payment keys this close to expiry are not handed out again
+KEY_EXPIRY_MARGIN = 60
+
+# Bulk link generation: orders per write-back batch and Paymob calls in flight
+BULK_CHUNK_SIZE = 100
+DEFAULT_BULK_CONCURRENCY = 8
+MAX_BULK_CONCURRENCY = 32
+BULK_PROGRESS_EVENT = "paymob_bulk_links_progress"
+
+# Site page that mints a payment key on click, see www/paymob_pay.py
+SHORT_LINK_PATH = "/paymob_pay"
+
+
+def fetch_billing_rows(sales_order_names):
+	"""Load everything needed to build Paymob payloads for many Sales Orders in one query.
+
+	Returns a dict of Sales Order name -> row.
+	"""
+	if not sales_order_names:
+		return {}
+
+	rows = frappe.db.sql(
+		"""
+        select
+            so.name, so.docstatus, so.grand_total, so.currency, so.customer, so.customer_name,
+            so.contact_email, so.contact_phone, so.contact_mobile, so.paymob_merchant_order_id,
+            so.paymob_order_id, so.paymob_payment_link,
+            (
+                select t.amount from `tabPaymob Transaction` t
+                where t.sales_order = so.name and t.source = 'Payment Link'
+                    and t.merchant_order_id = so.paymob_merchant_order_id
+                order by t.creation desc, t.name desc
+                limit 1
+            ) as paymob_order_amount,
+            contact.email_id as contact_person_email, contact.phone as contact_person_phone,
+            address.city, address.pincode, address.address_line1, address.country
+        from `tabSales Order` so
+        left join `tabContact` contact on contact.name = so.contact_person
+        left join `tabAddress` address on address.name = so.shipping_address_name
+        where so.name in %(names)s
+        """,
+		{"names": tuple(sales_order_names)},
+		as_dict=True,
+	)
+	return {row.name: row for row in rows}
+
+
+def billing_data(row):
+	"""Paymob `billing_data` from a `fetch_billing_rows` row.
+
+	Paymob requires all these keys. Use best-effort data from the SO; fall back to safe defaults.
+	"""
+	country_code = row.get("country") or "SA"
+	if country_code == "Saudi Arabia":
+		country_code = "SA"
+
+	return {
+		"apartment": "NA",
+		"email": row.get("contact_email") or row.get("contact_person_email") or "customer@example.com",
+		"floor": "NA",
+		"first_name": (row.get("customer_name") or "Customer").split(" ")[0][:50],
+		"street": row.get("address_line1") or "King Fahd Rd",
+		"building": "10",
+		"phone_number": row.get("contact_phone") or row.get("contact_person_phone") or "+966500000000",
+		"shipping_method": "PKG",
+		"postal_code": row.get("pincode") or "11564",
+		"city": row.get("city") or "Riyadh",
+		"country": country_code,
+		"last_name": "Customer",
+		"state": "Riyadh",
+	}
+
+
+def get_amount_cents(row):
+	"""Paymob expects integer "amount_cents"; throws for orders that can't be paid"""
+	if row.get("grand_total") is None:
+		frappe.throw(_("Sales Order has no grand total."))
+	amount_cents = cint(round(flt(row.grand_total) * 100))
+	if amount_cents <= 0:
+		frappe.throw(_("Amount must be > 0 to create a payment link."))
+	return amount_cents
+
+
+def new_merchant_order_id(sales_order_name):
+	return f"{sales_order_name}-{random_string(6)}"
+
+
+def build_order_payload(amount_cents, merchant_order_id):
+	return {
+		"delivery_needed": False,
+		"amount_cents": amount_cents,
+		"currency": CURRENCY,
+		"merchant_order_id": merchant_order_id,
+		"items": [],
+	}
+
+
+def get_payment_key_expiration(settings):
+	return cint(settings.get("payment_key_expiration")) or PAYMENT_KEY_EXPIRATION
+
+
+def build_payment_key_payload(row, amount_cents, paymob_order_id, settings):
+	return {
+		"amount_cents": amount_cents,
+		"currency": CURRENCY,
+		"order_id": paymob_order_id,
+		"integration_id": cint(settings.integration_id),
+		"expiration": get_payment_key_expiration(settings),
+		"billing_data": billing_data(row),
+	}
+
+
+def iframe_url(settings, payment_token):
+	return (
+		f"{PAYMOB_BASE_URL}/api/acceptance/iframes/{cint(settings.iframe_id)}?payment_token={payment_token}"
+	)
+
+
+def validate_settings(settings):
+	if settings.missing:
+		frappe.throw(_("Missing in Paymob Settings: {0}").format(", ".join(settings.missing)))
+
+
+def request_payment_link(row, settings, timings=None):
+	"""Create the Paymob order and payment key for one billing row.
+
+	A link created earlier for the same Sales Order, amount, currency and
+	integration is returned as is while its payment key is valid (`cache`
+	is "hit"); once the key expired, or the cache lost the link while the
+	Sales Order still holds its Paymob order for the same amount, only a new
+	key is requested for that order ("refresh"). Otherwise both are created
+	("miss").
+
+	Only talks to Paymob and Redis (no database access), so it is safe to
+	run from worker threads. Returns the values to store on the Sales Order.
+	"""
+	timings = {} if timings is None else timings
+	amount_cents = get_amount_cents(row)
+
+	cached = get_cached_link(row, settings)
+	if cached and cached["expires_at"] - KEY_EXPIRY_MARGIN > time.time():
+		metrics.incr("paymob_link_cache_total", result="hit")
+		return _link(settings, cached, "hit")
+
+	with timed(timings, "auth"):
+		# Warms the shared token cache; the next calls reuse the token
+		get_auth_token(settings.api_key)
+
+	cached = cached or stored_order(row, amount_cents)
+	if cached:
+		result = "refresh"
+		merchant_order_id = cached["merchant_order_id"]
+		paymob_order_id = cached["paymob_order_id"]
+	else:
+		result = "miss"
+		merchant_order_id, paymob_order_id = create_order(row, amount_cents, settings, timings)
+
+	with timed(timings, "payment_key"):
+		payment_key_res = authed_post(
+			PAYMENT_KEY_URL,
+			build_payment_key_payload(row, amount_cents, paymob_order_id, settings),
+			settings.api_key,
+		)
+	payment_token = payment_key_res.get("token")
+	if not payment_token:
+		frappe.throw(_("Paymob did not return a payment token."))
+
+	cached = {
+		"amount_cents": amount_cents,
+		"merchant_order_id": merchant_order_id,
+		"paymob_order_id": paymob_order_id,
+		"payment_token": payment_token,
+		"expires_at": time.time() + get_payment_key_expiration(settings),
+	}
+	cache_link(row, settings, cached)
+	metrics.incr("paymob_link_cache_total", result=result)
+	return _link(settings, cached, result)
+
+
+def stored_order(row, amount_cents):
+	"""The Paymob order stored on the Sales Order if it was created for `amount_cents`, or None"""
+	if not (row.get("paymob_order_id") and row.get("paymob_merchant_order_id")):
+		return None
+	if row.get("paymob_order_amount") is None:
+		return None
+	if cint(round(flt(row.paymob_order_amount) * 100)) != amount_cents:
+		return None
+	return {"merchant_order_id": row.paymob_merchant_order_id, "paymob_order_id": cint(row.paymob_order_id)}
+
+
+def create_order(row, amount_cents, settings, timings):
+	"""Create the Paymob order for a billing row; returns (merchant_order_id, paymob_order_id)"""
+	# Reuse the existing merchant_order_id if available, otherwise generate a new one
+	merchant_order_id = row.get("paymob_merchant_order_id") or new_merchant_order_id(row.name)
+	with timed(timings, "order"):
+		try:
+			order_res = authed_post(
+				ORDER_URL, build_order_payload(amount_cents, merchant_order_id), settings.api_key
+			)
+		except frappe.exceptions.ValidationError as e:
+			if "duplicate" not in str(e).lower():
+				raise
+			# Paymob already has an order for this merchant_order_id, retry with a new one
+			merchant_order_id = new_merchant_order_id(row.name)
+			order_res = authed_post(
+				ORDER_URL, build_order_payload(amount_cents, merchant_order_id), settings.api_key
+			)
+
+	paymob_order_id = order_res.get("id")
+	if not paymob_order_id:
+		frappe.throw(_("Paymob did not return an order id."))
+	return merchant_order_id, paymob_order_id
+
+
+def _link(settings, cached, result):
+	return {
+		"amount_cents": cached["amount_cents"],
+		"merchant_order_id": cached["merchant_order_id"],
+		"paymob_order_id": cached["paymob_order_id"],
+		"payment_token": cached["payment_token"],
+		"payment_url": iframe_url(settings, cached["payment_token"]),
+		"cache": result,
+	}
+
+
+def _link_cache_key(row, settings):
+	# A changed amount, currency or integration needs a new Paymob order
+	return frappe.cache().make_key(
+		f"paymob:payment_link:{row.name}:{flt(row.grand_total)}:{row.currency}:{cint(settings.integration_id)}"
+	)
+
+
+def get_cached_link(row, settings):
+	"""The Paymob order and payment key last created for this state of the Sales Order, or None"""
+	try:
+		value = frappe.cache().get(_link_cache_key(row, settings))
+	except Exception:
+		return None
+	return frappe.parse_json(frappe.safe_decode(value)) if value else None
+
+
+def clear_link_cache(sales_order_name):
+	"""Forget the cached links of a Sales Order, so no payment key of them is handed out again"""
+	frappe.cache().delete_keys(f"paymob:payment_link:{sales_order_name}:")
+
+
+def clear_link_cache_on_cancel(doc, method=None):
+	"""Sales Order `on_cancel` hook; its amendment gets a new name and Paymob order"""
+	clear_link_cache(doc.name)
+
+
+def cache_link(row, settings, cached):
+	try:
+		frappe.cache().set(
+			_link_cache_key(row, settings), frappe.as_json(cached, indent=None), ex=LINK_CACHE_TTL
+		)
+	except Exception:
+		# Without the cache the next request simply creates a new order
+		pass
+
+
+def ledger_entry(sales_order_name, link):
+	"""Paymob Transaction row for a `request_payment_link` result"""
+	return {
+		"sales_order": sales_order_name,
+		"status": "Pending",
+		"source": "Payment Link",
+		"merchant_order_id": link["merchant_order_id"],
+		"paymob_order_id": link["paymob_order_id"],
+		"amount": link["amount_cents"] / 100,
+		"currency": CURRENCY,
+	}
+
+
+def short_link_key(sales_order_name):
+	"""Signature that lets a short link open the payment page of exactly one Sales Order"""
+	digest = hmac.new(get_encryption_key().encode(), sales_order_name.encode(), hashlib.sha256).digest()
+	return base64.urlsafe_b64encode(digest)[:16].decode()
+
+
+def short_link(sales_order_name):
+	"""Site URL that redirects to a valid Paymob payment page for the Sales Order.
+
+	Unlike the iframe URL it never goes stale, so it is what gets stored and sent.
+	"""
+	query = urlencode({"order": sales_order_name, "key": short_link_key(sales_order_name)})
+	return get_url(f"{SHORT_LINK_PATH}?{query}")
+
+
+def verify_short_link(sales_order_name, key):
+	if not (sales_order_name and key):
+		return False
+	return hmac.compare_digest(short_link_key(sales_order_name), key)
+
+
+def needs_save(row, link):
+	"""Whether a `request_payment_link` result changes what is stored on the Sales Order"""
+	return link["cache"] == "miss" or row.get("paymob_payment_link") != short_link(row.name)
+
+
+def sales_order_values(sales_order_name, link):
+	"""Sales Order field values for a `request_payment_link` result"""
+	return {
+		"paymob_payment_link": short_link(sales_order_name),
+		"paymob_order_id": link["paymob_order_id"],
+		"paymob_merchant_order_id": link["merchant_order_id"],
+	}
+
+
+def save_link(sales_order_name, link):
+	"""Store a `request_payment_link` result on the Sales Order; a new Paymob order also goes to the ledger"""
+	frappe.db.set_value("Sales Order", sales_order_name, sales_order_values(sales_order_name, link))
+	if link["cache"] == "miss":
+		remember_order_ids(sales_order_name, link["merchant_order_id"], link["paymob_order_id"])
+		transactions.record([ledger_entry(sales_order_name, link)])
+		metrics.incr("paymob_links_created_total")
+
+
+@metrics.timer("create_payment_link")
+def create_payment_link(sales_order_name, settings):
+	"""Hot path behind `create_payment_link_v2`: one read, two Paymob calls, one write"""
+	timings = {}
+	started = time.perf_counter()
+	validate_settings(settings)
+
+	with timed(timings, "prefetch"), tracing.span("payment_link.prefetch"):
+		row = fetch_billing_rows([sales_order_name]).get(sales_order_name)
+	if not row:
+		frappe.throw(_("Sales Order {0} not found").format(sales_order_name))
+
+	link = request_payment_link(row, settings, timings)
+
+	# The stored short link already serves hits and refreshed keys of the same Paymob order
+	if needs_save(row, link):
+		with timed(timings, "save"), tracing.span("payment_link.save"):
+			save_link(row.name, link)
+			if link["cache"] == "miss":
+				frappe.get_doc(
+					{
+						"doctype": "Comment",
+						"comment_type": "Info",
+						"reference_doctype": "Sales Order",
+						"reference_name": row.name,
+						"comment_email": frappe.session.user,
+						"content": _("Paymob payment link generated and saved."),
+					}
+				).insert(ignore_permissions=True)
+
+	timings["total"] = _elapsed_ms(started)
+
+	return {
+		"success": True,
+		"sales_order": row.name,
+		"amount_cents": link["amount_cents"],
+		"currency": CURRENCY,
+		"paymob_order_id": link["paymob_order_id"],
+		"payment_token": link["payment_token"],
+		"payment_url": link["payment_url"],
+		"short_link": short_link(row.name),
+		"cache": link["cache"],
+		"timings": timings,
+	}
+
+
+@metrics.timer("create_payment_links_job")
+def create_payment_links_job(sales_order_names, chunk_size=BULK_CHUNK_SIZE):
+	"""Background job behind `create_payment_links_bulk`.
+
+	Billing data for all orders is loaded up front, Paymob calls fan out over
+	a bounded thread pool sharing one pooled session and auth token, and the
+	results are written back with one batched update per chunk.
+	"""
+	settings = get_settings()
+	validate_settings(settings)
+
+	names = list(dict.fromkeys(sales_order_names))
+	rows = fetch_billing_rows(names)
+	failed = {}
+	pending = []
+	for name in names:
+		row = rows.get(name)
+		if not row:
+			failed[name] = _("Sales Order not found")
+		elif row.docstatus != 1:
+			failed[name] = _("Sales Order is not submitted")
+		else:
+			pending.append(row)
+
+	# Authenticate once; worker threads pick the token up from the process cache
+	get_auth_token(settings.api_key)
+
+	created = 0
+	started = time.perf_counter()
+	concurrency = min(
+		cint(settings.get("bulk_concurrency")) or DEFAULT_BULK_CONCURRENCY, MAX_BULK_CONCURRENCY
+	)
+	with site_executor(concurrency) as executor:
+		for i in range(0, len(pending), chunk_size):
+			chunk = pending[i : i + chunk_size]
+			futures = {executor.submit(request_payment_link, row, settings): row.name for row in chunk}
+
+			updates = {}
+			ledger = []
+			reused = 0
+			for future in as_completed(futures):
+				name = futures[future]
+				try:
+					link = future.result()
+				except Exception as e:
+					failed[name] = strip_html(str(e))
+					continue
+				if needs_save(rows[name], link):
+					updates[name] = sales_order_values(name, link)
+				if link["cache"] == "miss":
+					ledger.append(ledger_entry(name, link))
+				else:
+					reused += 1
+
+			if updates:
+				with tracing.span("payment_link.bulk_save"):
+					frappe.db.bulk_update("Sales Order", updates)
+					transactions.record(ledger)
+				for entry in ledger:
+					remember_order_ids(
+						entry["sales_order"], entry["merchant_order_id"], entry["paymob_order_id"]
+					)
+			frappe.db.commit()
+			created += len(ledger) + reused
+			metrics.incr("paymob_links_created_total", len(ledger))
+
+			_publish_bulk_progress(len(names), created, failed)
+
+	summary = {
+		"total": len(names),
+		"created": created,
+		"failed": failed,
+		"seconds": round(time.perf_counter() - started, 2),
+	}
+	_publish_bulk_progress(len(names), created, failed, finished=True)
+	if failed:
+		frappe.log_error(
+			f"Paymob bulk payment links: {len(failed)} of {len(names)} failed\n{frappe.as_json(failed)}",
+			"Paymob Bulk Payment Links",
+		)
+	return summary
+
+
+def _publish_bulk_progress(total, created, failed, finished=False):
+	frappe.publish_realtime(
+		BULK_PROGRESS_EVENT,
+		{
+			"total": total,
+			"done": created + len(failed),
+			"created": created,
+			"failed": len(failed),
+			"errors": failed if finished else None,
+			"finished": finished,
+		},
+		user=frappe.session.user,
+	)
+
+
+@contextmanager
+def timed(timings, step):
+	"""Record the duration of a pipeline step in milliseconds"""
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		timings[step] = _elapsed_ms(started)
+
+
+def _elapsed_ms(started):
+	return round((time.perf_counter() - started) * 1000, 1)
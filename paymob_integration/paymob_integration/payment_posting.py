@@ -0,0 +1,256 @@
+import time
+
+import frappe
+from erpnext.accounts.party import get_party_account
+from erpnext.accounts.utils import get_account_currency
+from frappe import _
+from frappe.utils import flt, nowdate, strip_html
+
+from paymob_integration.paymob_integration import metrics, payment_link, tracing, transactions
+from paymob_integration.paymob_integration.resolver import (
+	PAYMENT_FIELDS,
+	get_sales_order_for_payment,
+	resolve_sales_order,
+)
+
+MODE_OF_PAYMENT = "Paymob"
+DEFAULT_CHUNK_SIZE = 50
+# Reference number of entries whose transaction id Paymob didn't report
+FALLBACK_REFERENCE = "Paymob"
+
+
+def transaction_from_webhook(webhook_data):
+	"""Confirmed-transaction dict for a Paymob callback, or None if its Sales Order can't be found"""
+	obj = webhook_data.get("obj") or {}
+	order = obj.get("order") or {}
+	merchant_order_id = order.get("merchant_order_id")
+	paymob_order_id = order.get("id")
+
+	if not (merchant_order_id or paymob_order_id):
+		frappe.log_error("No order ID in webhook data", "Paymob Webhook Error")
+		return None
+
+	# Resolve the Sales Order through the indexed Paymob ids, loading only what we need
+	with tracing.span("sales_order.resolve"):
+		sales_order_name = resolve_sales_order(merchant_order_id, paymob_order_id)
+	if not sales_order_name:
+		frappe.log_error(
+			f"Sales Order for Paymob order {paymob_order_id} ({merchant_order_id}) not found",
+			"Paymob Webhook Error",
+		)
+		return None
+
+	return frappe._dict(
+		sales_order=get_sales_order_for_payment(sales_order_name),
+		transaction_id=obj.get("id"),
+		amount=flt(obj.get("amount_cents")) / 100,
+		currency=obj.get("currency"),
+		success=bool(obj.get("success")),
+		merchant_order_id=merchant_order_id,
+		paymob_order_id=paymob_order_id,
+		source="Webhook",
+		# Webhook payments also mark the submitted Sales Order as Completed
+		complete_order=True,
+	)
+
+
+def record_failed_payment(txn):
+	"""Mark the Sales Order of a declined `transaction_from_webhook` transaction and log it in the ledger"""
+	frappe.db.set_value(
+		"Sales Order",
+		txn.sales_order.name,
+		{"paymob_transaction_id": txn.transaction_id, "paymob_payment_status": "Failed"},
+	)
+	transactions.record([ledger_entry(txn, txn.sales_order, "Failed")])
+
+
+def ledger_entry(txn, sales_order, status, payment_entry=None):
+	"""Paymob Transaction row for a transaction dict as taken by `post_payment_entries`"""
+	return {
+		"sales_order": sales_order.name,
+		"status": status,
+		"source": txn.get("source"),
+		"merchant_order_id": txn.get("merchant_order_id"),
+		"paymob_order_id": txn.get("paymob_order_id"),
+		"transaction_id": txn.get("transaction_id"),
+		"amount": flt(txn.get("amount")),
+		"currency": txn.get("currency") or sales_order.get("currency"),
+		"payment_entry": payment_entry,
+	}
+
+
+class PaymentEntryPoster:
+	"""Builds Payment Entries for Paymob transactions.
+
+	Accounts are resolved once per company and party accounts once per
+	(company, customer), however many payments are posted.
+	"""
+
+	def __init__(self):
+		self._company_accounts = {}
+		self._party_accounts = {}
+		self._mode_of_payment = frappe.db.exists("Mode of Payment", MODE_OF_PAYMENT)
+
+	def company_accounts(self, company):
+		if company not in self._company_accounts:
+			paid_to = frappe.db.get_value(
+				"Mode of Payment Account", {"parent": MODE_OF_PAYMENT, "company": company}, "default_account"
+			) or frappe.get_cached_value("Company", company, "default_bank_account")
+			if not paid_to:
+				frappe.throw(
+					_(
+						"Please set a Default Bank Account in Company {0} or an account on the Paymob Mode of Payment."
+					).format(company)
+				)
+			self._company_accounts[company] = (paid_to, get_account_currency(paid_to))
+		return self._company_accounts[company]
+
+	def party_account(self, company, customer):
+		key = (company, customer)
+		if key not in self._party_accounts:
+			account = get_party_account("Customer", customer, company)
+			self._party_accounts[key] = (account, get_account_currency(account))
+		return self._party_accounts[key]
+
+	def build(self, sales_order, amount, transaction_id):
+		paid_to, paid_to_currency = self.company_accounts(sales_order.company)
+		paid_from, paid_from_currency = self.party_account(sales_order.company, sales_order.customer)
+
+		return frappe.get_doc(
+			{
+				"doctype": "Payment Entry",
+				"payment_type": "Receive",
+				"posting_date": nowdate(),
+				"company": sales_order.company,
+				"mode_of_payment": MODE_OF_PAYMENT if self._mode_of_payment else None,
+				"party_type": "Customer",
+				"party": sales_order.customer,
+				"paid_from": paid_from,
+				"paid_from_account_currency": paid_from_currency,
+				"paid_to": paid_to,
+				"paid_to_account_currency": paid_to_currency,
+				"paid_amount": amount,
+				"received_amount": amount,
+				"source_exchange_rate": 1,
+				"target_exchange_rate": 1,
+				"reference_no": str(transaction_id or FALLBACK_REFERENCE),
+				"reference_date": nowdate(),
+				"references": [
+					{
+						"reference_doctype": "Sales Order",
+						"reference_name": sales_order.name,
+						"allocated_amount": amount,
+					}
+				],
+			}
+		)
+
+
+@metrics.timer("post_payment_entries")
+def post_payment_entries(txns, chunk_size=DEFAULT_CHUNK_SIZE, commit=True):
+	"""Insert and submit Payment Entries for confirmed Paymob transactions.
+
+	Each transaction is a dict with `sales_order` (name or a dict with
+	`PAYMENT_FIELDS`), `amount`, `transaction_id` and optionally
+	`complete_order`, and the `source`, Paymob ids and `currency` to record
+	in the Paymob Transaction ledger. A failing entry is rolled back on its
+	own and reported, the rest of the chunk still posts. A transaction that
+	already has a submitted Payment Entry with its id as reference number is
+	skipped. With `commit`, every chunk is committed.
+
+	Returns a dict with `posted`, `skipped` and `failed` (all keyed by
+	transaction id; skipped ones are also in `posted` with their existing
+	entry), `seconds` and `entries_per_second`.
+	"""
+	started = time.perf_counter()
+	txns = list(txns)
+
+	# One query for every Sales Order that only came in by name
+	names = [t["sales_order"] for t in txns if isinstance(t["sales_order"], str)]
+	orders = {}
+	if names:
+		orders = {
+			row.name: row
+			for row in frappe.get_all("Sales Order", filters={"name": ["in", names]}, fields=PAYMENT_FIELDS)
+		}
+
+	# Webhooks, inquiries and reconciliation can all report the same payment
+	skipped = existing_payment_entries(txns)
+
+	poster = PaymentEntryPoster()
+	posted, failed = dict(skipped), {}
+
+	for i in range(0, len(txns), chunk_size):
+		sales_order_updates = {}
+		ledger = []
+		for txn in txns[i : i + chunk_size]:
+			sales_order = txn["sales_order"]
+			if isinstance(sales_order, str):
+				sales_order = orders.get(sales_order) or frappe._dict(name=sales_order)
+			key = str(txn.get("transaction_id") or sales_order.name)
+			if key in posted:
+				continue
+
+			frappe.db.savepoint("paymob_payment_entry")
+			try:
+				if not sales_order.get("company"):
+					frappe.throw(_("Sales Order {0} not found").format(sales_order.name))
+
+				with tracing.span("payment_entry.post"):
+					payment_entry = poster.build(sales_order, flt(txn["amount"]), txn.get("transaction_id"))
+					payment_entry.insert(ignore_permissions=True)
+					payment_entry.submit()
+			except Exception as e:
+				frappe.db.rollback(save_point="paymob_payment_entry")
+				failed[key] = strip_html(str(e)) or repr(e)
+				continue
+
+			posted[key] = payment_entry.name
+			values = {"paymob_payment_entry": payment_entry.name, "paymob_payment_status": "Paid"}
+			if txn.get("transaction_id"):
+				values["paymob_transaction_id"] = txn["transaction_id"]
+			if txn.get("complete_order") and sales_order.docstatus == 1:
+				values["status"] = "Completed"
+			sales_order_updates[sales_order.name] = values
+			ledger.append(ledger_entry(txn, sales_order, "Paid", payment_entry.name))
+
+		if sales_order_updates:
+			with tracing.span("payment_entry.update_sales_orders"):
+				frappe.db.bulk_update("Sales Order", sales_order_updates)
+			transactions.record(ledger)
+			for name in sales_order_updates:
+				payment_link.clear_link_cache(name)
+		if commit:
+			frappe.db.commit()
+
+	if len(posted) > len(skipped):
+		metrics.incr("paymob_payment_entries_posted_total", len(posted) - len(skipped))
+	if failed:
+		metrics.incr("paymob_payment_entries_failed_total", len(failed))
+
+	seconds = time.perf_counter() - started
+	created = len(posted) - len(skipped)
+	return {
+		"posted": posted,
+		"skipped": skipped,
+		"failed": failed,
+		"seconds": round(seconds, 3),
+		"entries_per_second": round(created / seconds, 2) if seconds and created else 0,
+	}
+
+
+def existing_payment_entries(txns):
+	"""Submitted Payment Entries whose reference number is one of the transaction ids, keyed by that id"""
+	transaction_ids = {str(txn["transaction_id"]) for txn in txns if txn.get("transaction_id")}
+	transaction_ids.discard(FALLBACK_REFERENCE)
+	if not transaction_ids:
+		return {}
+
+	return dict(
+		frappe.get_all(
+			"Payment Entry",
+			filters={"reference_no": ["in", list(transaction_ids)], "party_type": "Customer", "docstatus": 1},
+			fields=["reference_no", "name"],
+			as_list=True,
+		)
+	)
@@ -0,0 +1,137 @@
+"""Payment status lookups for the status endpoints, list views and external polling.
+
+This is the only read path for payment status. Statuses are read with one
+narrow query on the Paymob fields of Sales Order, which every ledger write
+updates in the same transaction, and cached per order in Redis for a few
+seconds. Every ledger write drops the cached entries of its Sales Orders
+once it commits, so a poll never sees a status older than the last
+committed change, and pushes the new status to open Sales Order forms and
+the customer's portal users.
+"""
+
+import hashlib
+
+import frappe
+from frappe import _
+
+MAX_NAMES = 1000
+CACHE_TTL = 10
+STATUS_EVENT = "paymob_payment_status"
+
+STATUS_FIELDS = [
+	"paymob_order_id",
+	"paymob_transaction_id",
+	"paymob_payment_status",
+	"paymob_payment_link",
+	"paymob_payment_entry",
+]
+
+
+def _key(sales_order_name):
+	return frappe.cache().make_key(f"paymob:payment_status:{sales_order_name}")
+
+
+def get_statuses(sales_order_names):
+	"""Paymob status fields of many Sales Orders, keyed by name; unknown names are left out"""
+	names = [name for name in dict.fromkeys(sales_order_names or []) if name]
+	if len(names) > MAX_NAMES:
+		frappe.throw(_("At most {0} Sales Orders can be looked up at once.").format(MAX_NAMES))
+	if not names:
+		return {}
+
+	cache = frappe.cache()
+	statuses = {}
+	try:
+		cached = cache.mget([_key(name) for name in names])
+	except Exception:
+		cached = [None] * len(names)
+
+	for name, value in zip(names, cached, strict=True):
+		if value is not None:
+			status = frappe.parse_json(frappe.safe_decode(value))
+			if status:
+				statuses[name] = status
+
+	missing = [name for name, value in zip(names, cached, strict=True) if value is None]
+	if missing:
+		rows = {
+			row.pop("name"): row
+			for row in frappe.get_all(
+				"Sales Order", filters={"name": ["in", missing]}, fields=["name", *STATUS_FIELDS]
+			)
+		}
+		statuses.update(rows)
+		try:
+			pipe = cache.pipeline(transaction=False)
+			for name in missing:
+				# Unknown names are cached too, so polling for them stays cheap
+				pipe.set(_key(name), frappe.as_json(rows.get(name) or {}, indent=None), ex=CACHE_TTL)
+			pipe.execute()
+		except Exception:
+			pass
+
+	return {name: statuses[name] for name in names if name in statuses}
+
+
+def status_changed(entries):
+	"""Invalidate and publish the statuses of the Sales Orders of new ledger rows"""
+	invalidate([entry.get("sales_order") for entry in entries])
+	publish(entries)
+
+
+def publish(entries):
+	"""Push each Sales Order's new status to its form and its customer's portal users after commit"""
+	latest = {entry["sales_order"]: entry for entry in entries if entry.get("sales_order")}
+	if not latest:
+		return
+
+	customers = dict(
+		frappe.get_all(
+			"Sales Order", filters={"name": ["in", list(latest)]}, fields=["name", "customer"], as_list=True
+		)
+	)
+	portal_users = {}
+	if customers:
+		for customer, user in frappe.db.sql(
+			"""
+            select link.link_name, contact.user
+            from `tabContact` contact
+            join `tabDynamic Link` link
+                on link.parent = contact.name and link.parenttype = 'Contact' and link.link_doctype = 'Customer'
+            where link.link_name in %(customers)s and coalesce(contact.user, '') != ''
+            """,
+			{"customers": tuple(set(customers.values()))},
+		):
+			portal_users.setdefault(customer, set()).add(user)
+
+	for name, entry in latest.items():
+		message = {
+			"sales_order": name,
+			"status": entry.get("status"),
+			"transaction_id": entry.get("transaction_id"),
+			"payment_entry": entry.get("payment_entry"),
+		}
+		frappe.publish_realtime(STATUS_EVENT, message, doctype="Sales Order", docname=name, after_commit=True)
+		for user in portal_users.get(customers.get(name), ()):
+			frappe.publish_realtime(STATUS_EVENT, message, user=user, after_commit=True)
+
+
+def invalidate(sales_order_names):
+	"""Drop cached statuses once the current transaction commits"""
+	keys = [_key(name) for name in set(sales_order_names) if name]
+	if keys:
+		frappe.db.after_commit.add(lambda: frappe.cache().delete(*keys))
+
+
+def etag(statuses):
+	"""Weak ETag over a `get_statuses` result"""
+	digest = hashlib.sha1(frappe.as_json(statuses, indent=None).encode()).hexdigest()
+	return f'W/"{digest[:32]}"'
+
+
+def etag_matches(etag, if_none_match):
+	"""Whether an If-None-Match header value names `etag`, using weak comparison"""
+	if not if_none_match:
+		return False
+	tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+	return "*" in tags or etag.removeprefix("W/") in tags
@@ -0,0 +1,126 @@
+"""Client-side rate limiting of outbound Paymob calls, shared by all workers.
+
+Each endpoint family has a token bucket in Redis, updated by one Lua script
+call per request. A caller reserves a token and learns how long to wait
+for it, so concurrent workers queue up fairly and a large batch runs at
+the configured rate instead of tripping Paymob's 429s.
+
+Rates can be overridden per site, e.g. in site_config.json:
+
+    "paymob_rate_limits": {"orders": [30, 30], "inquiry": [50, 100]}
+
+where each value is [requests per second, burst].
+"""
+
+import time
+
+import frappe
+from frappe import _
+
+from paymob_integration.paymob_integration import metrics
+
+# Endpoint names as reported by `tracing.endpoint_name`
+FAMILIES = {
+	"paymob.auth": "auth",
+	"paymob.order": "orders",
+	"paymob.payment_key": "payment_keys",
+	"paymob.inquiry": "inquiry",
+}
+
+# (requests per second, burst) per family
+DEFAULT_LIMITS = {
+	"auth": (2, 5),
+	"orders": (20, 20),
+	"payment_keys": (20, 20),
+	"inquiry": (20, 40),
+}
+
+# Callers that would have to queue longer than this give up instead
+MAX_WAIT = 30
+
+# Returns the seconds the caller must wait for its token, or -1 if that exceeds max_wait.
+# Tokens may go negative: each caller reserves the next free slot.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+    if wait > max_wait then
+        return '-1'
+    end
+end
+
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate + max_wait) + 60)
+return tostring(wait)
+"""
+
+_script = None
+
+
+class RateLimitExceeded(frappe.ValidationError):
+	pass
+
+
+def reserve(endpoint):
+	"""Take a token for `endpoint` and return how many seconds to wait before calling.
+
+	Endpoints without a family are not limited. Throws `RateLimitExceeded`
+	when the queue for the family is longer than `MAX_WAIT`.
+	"""
+	family = FAMILIES.get(endpoint)
+	if not family:
+		return 0
+
+	rate, burst = get_limit(family)
+	try:
+		wait = float(
+			_get_script()(
+				keys=[frappe.cache().make_key(f"paymob:rate_limit:{family}")],
+				args=[rate, burst, time.time(), MAX_WAIT],
+			)
+		)
+	except Exception:
+		# Without Redis there is nothing to coordinate with; don't block payments
+		return 0
+
+	if wait < 0:
+		metrics.incr("paymob_rate_limit_rejections_total", family=family)
+		frappe.throw(
+			_("Too many Paymob {0} requests queued; please try again shortly.").format(family),
+			exc=RateLimitExceeded,
+		)
+
+	metrics.observe("paymob_rate_limit_wait_seconds", wait, family=family)
+	return wait
+
+
+def acquire(endpoint):
+	"""Block until a call to `endpoint` is within the shared rate limit"""
+	wait = reserve(endpoint)
+	if wait:
+		time.sleep(wait)
+
+
+def get_limit(family):
+	configured = (frappe.conf.get("paymob_rate_limits") or {}).get(family)
+	if configured:
+		rate, burst = configured
+		return float(rate), max(1.0, float(burst))
+	return DEFAULT_LIMITS[family]
+
+
+def _get_script():
+	global _script
+	if _script is None:
+		_script = frappe.cache().register_script(TOKEN_BUCKET_SCRIPT)
+	return _script
@@ -0,0 +1,153 @@
+import frappe
+from frappe.utils import add_days, cint, flt, now_datetime
+
+from paymob_integration.paymob_integration import metrics, transactions
+from paymob_integration.paymob_integration.payment_link import (
+	DEFAULT_BULK_CONCURRENCY,
+	MAX_BULK_CONCURRENCY,
+	clear_link_cache,
+)
+from paymob_integration.paymob_integration.payment_posting import ledger_entry, post_payment_entries
+from paymob_integration.paymob_integration.resolver import PAYMENT_FIELDS
+from paymob_integration.paymob_integration.settings import get_settings
+from paymob_integration.paymob_integration.token_cache import authed_post, get_auth_token
+from paymob_integration.paymob_integration.transport import PAYMOB_BASE_URL, site_executor
+
+INQUIRY_URL = f"{PAYMOB_BASE_URL}/api/ecommerce/orders/transaction_inquiry"
+
+BATCH_SIZE = 100
+# Orders older than this are no longer swept; their payment links expired long ago
+LOOKBACK_DAYS = 14
+
+
+@metrics.timer("reconcile_pending_orders")
+def reconcile_pending_orders(batch_size=BATCH_SIZE):
+	"""Scheduled sweep for Paymob orders whose webhook never arrived.
+
+	Walks the Paymob Transaction ledger for Sales Orders whose latest state
+	is a Pending Paymob order, in keyset-paginated batches, asks Paymob about
+	all of a batch concurrently with one shared token, and posts Payment
+	Entries for the newly paid ones.
+	"""
+	settings = get_settings()
+	if not settings.api_key:
+		return
+
+	# Authenticate once; worker threads pick the token up from the process cache
+	get_auth_token(settings.api_key)
+	concurrency = min(
+		cint(settings.get("bulk_concurrency")) or DEFAULT_BULK_CONCURRENCY, MAX_BULK_CONCURRENCY
+	)
+	cutoff = add_days(now_datetime(), -LOOKBACK_DAYS)
+
+	summary = {"checked": 0, "already_paid": 0, "posted": 0, "skipped": 0, "failed": {}}
+	last_name = ""
+	with site_executor(concurrency) as executor:
+		while True:
+			attempts = transactions.pending(cutoff, after=last_name, limit=batch_size)
+			if not attempts:
+				break
+			last_name = attempts[-1].name
+
+			orders = _submitted_orders(attempts)
+			if not orders:
+				continue
+
+			inquiries = executor.map(lambda order: _inquire(settings.api_key, order.paymob_order_id), orders)
+			_reconcile_batch(orders, list(inquiries), summary)
+
+	if summary["failed"]:
+		frappe.log_error(
+			f"Paymob reconciliation: {len(summary['failed'])} payments could not be posted\n"
+			f"{frappe.as_json(summary['failed'])}",
+			"Paymob Reconciliation",
+		)
+	return summary
+
+
+def _submitted_orders(attempts):
+	"""The submitted Sales Orders of pending ledger rows, with the Paymob ids of those rows"""
+	by_name = {attempt.sales_order: attempt for attempt in attempts}
+	orders = frappe.get_all(
+		"Sales Order",
+		filters={"name": ["in", list(by_name)], "docstatus": 1},
+		fields=PAYMENT_FIELDS,
+	)
+	for order in orders:
+		order.paymob_order_id = by_name[order.name].paymob_order_id
+		order.merchant_order_id = by_name[order.name].merchant_order_id
+	return orders
+
+
+def _inquire(api_key, paymob_order_id):
+	"""Latest transaction for a Paymob order, or None if Paymob has none (or is unreachable)"""
+	try:
+		return authed_post(INQUIRY_URL, {"order_id": paymob_order_id}, api_key)
+	except Exception:
+		return None
+
+
+def _reconcile_batch(orders, inquiries, summary):
+	paid = [
+		(order, res)
+		for order, res in zip(orders, inquiries, strict=True)
+		if res and res.get("pending") is False and res.get("success") is True
+	]
+	summary["checked"] += len(orders)
+	if not paid:
+		return
+
+	# Orders paid through another route only need their status fixed
+	existing = {
+		row.reference_name: row.parent
+		for row in frappe.get_all(
+			"Payment Entry Reference",
+			filters={
+				"reference_doctype": "Sales Order",
+				"reference_name": ["in", [order.name for order, _res in paid]],
+				"docstatus": 1,
+			},
+			fields=["reference_name", "parent"],
+		)
+	}
+	if existing:
+		frappe.db.bulk_update(
+			"Sales Order",
+			{
+				name: {"paymob_payment_status": "Paid", "paymob_payment_entry": payment_entry}
+				for name, payment_entry in existing.items()
+			},
+		)
+		transactions.record(
+			[
+				ledger_entry(_transaction(order, res), order, "Paid", existing[order.name])
+				for order, res in paid
+				if order.name in existing
+			]
+		)
+		frappe.db.commit()
+		for name in existing:
+			clear_link_cache(name)
+		summary["already_paid"] += len(existing)
+
+	to_post = [_transaction(order, res) for order, res in paid if order.name not in existing]
+	if to_post:
+		result = post_payment_entries(to_post)
+		# Entries that already existed under the transaction id are not new postings
+		summary["posted"] += len(result["posted"]) - len(result["skipped"])
+		summary["skipped"] += len(result["skipped"])
+		summary["failed"].update(result["failed"])
+
+
+def _transaction(order, res):
+	return {
+		"sales_order": order,
+		"amount": flt(res.get("amount_cents")) / 100,
+		"currency": res.get("currency"),
+		"transaction_id": str(
+			res.get("id") or res.get("transaction_no") or res.get("receipt_no") or "Paymob"
+		),
+		"source": "Reconciliation",
+		"merchant_order_id": order.merchant_order_id,
+		"paymob_order_id": order.paymob_order_id,
+	}
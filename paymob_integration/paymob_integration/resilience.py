@@ -0,0 +1,204 @@
+"""Retries with backoff and a shared circuit breaker for outbound Paymob/WAHA calls.
+
+Retries use exponential backoff with full jitter and honour Retry-After.
+Calls that are safe to repeat (auth, payment keys, inquiries) are retried
+on timeouts and 5xx; calls that create something (orders, WhatsApp
+messages) only when the request provably was not processed: the
+connection could not be made, or the server answered 429.
+
+The breaker is per endpoint and lives in Redis, so once an endpoint keeps
+failing, every worker fails fast for a while instead of waiting out its
+timeouts. After the cool-down a single probe call decides whether it
+closes again.
+"""
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import frappe
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+# A Retry-After longer than this is not worth holding a worker for
+MAX_RETRY_AFTER = 30
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses that count against the breaker; a 429 only means slow down and is handled by retries
+FAILURE_STATUSES = RETRY_STATUSES - {429}
+# Endpoint names as reported by `tracing.endpoint_name`
+IDEMPOTENT_ENDPOINTS = {"paymob.auth", "paymob.payment_key", "paymob.inquiry"}
+
+# This many failures within FAILURE_WINDOW open the breaker for OPEN_SECONDS
+FAILURE_THRESHOLD = 5
+FAILURE_WINDOW = 60
+OPEN_SECONDS = 30
+# How long a half-open breaker waits for its probe, and stays half-open at most
+PROBE_SECONDS = 10
+HALF_OPEN_SECONDS = 5 * 60
+
+# Errors that mean the call did not complete
+HTTP_ERRORS = (requests.exceptions.RequestException,)
+
+# Worth retrying for calls that are safe to repeat
+TRANSIENT_ERRORS = (
+	requests.exceptions.Timeout,
+	requests.exceptions.ConnectionError,
+)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+	"""Raised instead of calling an endpoint whose breaker is open.
+
+	A `ConnectionError`, so existing network error handling applies unchanged.
+	"""
+
+
+def call(send, endpoint):
+	"""Run `send(attempt)`, which returns a `requests.Response`, under the breaker with retries"""
+	attempt = 0
+	while True:
+		attempt += 1
+		probe = before_call(endpoint)
+
+		try:
+			response = send(attempt)
+		except HTTP_ERRORS as e:
+			delay = _handle_error(endpoint, attempt, e, probe)
+		else:
+			delay = _handle_response(endpoint, attempt, response, probe)
+			if delay is None:
+				return response
+
+		time.sleep(delay)
+
+
+def _handle_error(endpoint, attempt, error, probe):
+	after_call(endpoint, failed=True, probe=probe)
+	delay = retry_delay(attempt, endpoint, error=error)
+	if delay is None:
+		raise error
+	return delay
+
+
+def _handle_response(endpoint, attempt, response, probe):
+	after_call(endpoint, failed=response.status_code in FAILURE_STATUSES, probe=probe)
+	return retry_delay(attempt, endpoint, response=response)
+
+
+def retry_delay(attempt, endpoint, response=None, error=None):
+	"""Seconds to wait before the next attempt, or None to give up"""
+	if attempt >= MAX_ATTEMPTS or isinstance(error, CircuitOpenError):
+		return None
+
+	idempotent = endpoint in IDEMPOTENT_ENDPOINTS
+	if error is not None:
+		if _never_connected(error):
+			return backoff(attempt)
+		if idempotent and isinstance(error, TRANSIENT_ERRORS):
+			return backoff(attempt)
+		return None
+
+	status = response.status_code
+	if status == 429 or (idempotent and status in RETRY_STATUSES):
+		retry_after = _retry_after(response)
+		if retry_after is None:
+			return backoff(attempt)
+		return retry_after if retry_after <= MAX_RETRY_AFTER else None
+	return None
+
+
+def backoff(attempt):
+	"""Full-jitter exponential backoff for a 1-based attempt number"""
+	return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def before_call(endpoint):
+	"""Raise `CircuitOpenError` unless `endpoint` may be called now.
+
+	Returns True when this call is the probe of a half-open breaker.
+	"""
+	cache = frappe.cache()
+	try:
+		is_open, half_open = cache.mget([_key(endpoint, "open"), _key(endpoint, "half_open")])
+		if not (is_open or half_open):
+			return False
+		if not is_open and cache.set(_key(endpoint, "probe"), 1, nx=True, ex=PROBE_SECONDS):
+			return True
+	except Exception:
+		# Without Redis there is no breaker; let the call through
+		return False
+
+	raise CircuitOpenError(f"Paymob circuit open for {endpoint}; calls are paused for a few seconds")
+
+
+def after_call(endpoint, failed, probe=False):
+	"""Count a failure, opening the breaker at the threshold, or close it after a good probe"""
+	cache = frappe.cache()
+	try:
+		if not failed:
+			if probe:
+				cache.delete(_key(endpoint, "half_open"), _key(endpoint, "probe"), _key(endpoint, "failures"))
+			return
+
+		if probe:
+			_open(endpoint)
+			return
+
+		failures_key = _key(endpoint, "failures")
+		failures = cache.incr(failures_key)
+		if failures == 1:
+			cache.expire(failures_key, FAILURE_WINDOW)
+		if failures >= FAILURE_THRESHOLD:
+			_open(endpoint)
+	except Exception:
+		pass
+
+
+def circuit_state(endpoint):
+	"""The breaker state of `endpoint`: closed, open or half_open"""
+	cache = frappe.cache()
+	if cache.get(_key(endpoint, "open")):
+		return "open"
+	if cache.get(_key(endpoint, "half_open")):
+		return "half_open"
+	return "closed"
+
+
+def _open(endpoint):
+	pipe = frappe.cache().pipeline(transaction=False)
+	pipe.set(_key(endpoint, "open"), 1, ex=OPEN_SECONDS)
+	pipe.set(_key(endpoint, "half_open"), 1, ex=OPEN_SECONDS + HALF_OPEN_SECONDS)
+	pipe.delete(_key(endpoint, "failures"), _key(endpoint, "probe"))
+	pipe.execute()
+
+
+def _key(endpoint, part):
+	return frappe.cache().make_key(f"paymob:circuit:{endpoint}:{part}")
+
+
+def _never_connected(error):
+	"""True if the request provably never reached the server"""
+	if isinstance(error, requests.exceptions.ConnectTimeout):
+		return True
+	if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+		return False
+	reason = getattr(error.args[0], "reason", None)
+	return isinstance(reason, NewConnectionError | ConnectTimeoutError)
+
+
+def _retry_after(response):
+	value = response.headers.get("Retry-After")
+	if not value:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	try:
+		return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
@@ -0,0 +1,64 @@
+import frappe
+from frappe.utils import cstr
+
+# Paymob ids never move to another Sales Order, so mappings can live long
+CACHE_TTL = 7 * 24 * 60 * 60
+
+# All a webhook needs from the Sales Order to record a payment
+PAYMENT_FIELDS = ["name", "company", "customer", "currency", "docstatus"]
+
+LOOKUP_FIELDS = ("paymob_merchant_order_id", "paymob_order_id")
+
+
+def _cache_key(fieldname, value):
+	return f"paymob:sales_order_for:{fieldname}:{value}"
+
+
+def resolve_sales_order(merchant_order_id=None, paymob_order_id=None):
+	"""Sales Order name for a Paymob merchant_order_id or order id, or None.
+
+	Both custom fields are indexed; results are cached in Redis.
+	"""
+	cache = frappe.cache()
+	ids = dict(zip(LOOKUP_FIELDS, (cstr(merchant_order_id), cstr(paymob_order_id)), strict=True))
+
+	for fieldname, value in ids.items():
+		if not value:
+			continue
+		name = cache.get_value(_cache_key(fieldname, value))
+		if name:
+			return name
+
+	for fieldname, value in ids.items():
+		if not value:
+			continue
+		name = frappe.db.get_value("Sales Order", {fieldname: value}, "name")
+		if name:
+			cache.set_value(_cache_key(fieldname, value), name, expires_in_sec=CACHE_TTL)
+			return name
+
+	# merchant_order_id is "{so.name}-{random}"; the stored id may since have been regenerated
+	merchant_order_id = ids["paymob_merchant_order_id"]
+	if "-" in merchant_order_id:
+		name = merchant_order_id.rsplit("-", 1)[0]
+		if frappe.db.exists("Sales Order", name):
+			return name
+
+	# Orders created before merchant_order_id got a suffix
+	if merchant_order_id and frappe.db.exists("Sales Order", merchant_order_id):
+		return merchant_order_id
+
+	return None
+
+
+def remember_order_ids(sales_order_name, merchant_order_id=None, paymob_order_id=None):
+	"""Prime the resolver cache when a Paymob order is created"""
+	cache = frappe.cache()
+	for fieldname, value in zip(LOOKUP_FIELDS, (merchant_order_id, paymob_order_id), strict=True):
+		if value:
+			cache.set_value(_cache_key(fieldname, cstr(value)), sales_order_name, expires_in_sec=CACHE_TTL)
+
+
+def get_sales_order_for_payment(sales_order_name):
+	"""The few Sales Order fields needed to post a payment, as a dict"""
+	return frappe.db.get_value("Sales Order", sales_order_name, PAYMENT_FIELDS, as_dict=True)
@@ -0,0 +1,99 @@
+import time
+
+import frappe
+from frappe.utils import cast
+
+SETTINGS_DOCTYPE = "Paymob Settings"
+
+# Needed before any Paymob order or payment key can be created
+REQUIRED_SETTINGS = ("api_key", "integration_id", "iframe_id")
+
+SETTINGS_FIELDS = (
+	"hmac",
+	"api_key",
+	"secret_key",
+	"public_key",
+	"integration_id",
+	"iframe_id",
+	"auto_create_payment_link",
+	"payment_key_expiration",
+	"waha_api_url",
+	"whatsapp_session_name",
+	"enable_whatsapp_notifications",
+	"whatsapp_messages_per_second",
+	"connect_timeout",
+	"read_timeout",
+	"bulk_concurrency",
+	"queue_webhooks",
+)
+
+CACHE_KEY = "paymob_settings_snapshot"
+
+# Other workers pick up a change in Redis within this many seconds
+LOCAL_TTL = 10
+
+_local = {}
+
+
+class PaymobSettingsSnapshot:
+	"""Read-only view of Paymob Settings, normalised and validated when built.
+
+	Supports attribute access and `.get()` like the Document it replaces.
+	"""
+
+	__slots__ = (*SETTINGS_FIELDS, "missing")
+
+	def __init__(self, values):
+		for fieldname in SETTINGS_FIELDS:
+			value = values.get(fieldname)
+			if isinstance(value, str):
+				value = value.strip()
+			object.__setattr__(self, fieldname, value)
+		object.__setattr__(self, "missing", tuple(f for f in REQUIRED_SETTINGS if not values.get(f)))
+
+	def __setattr__(self, name, value):
+		raise AttributeError(f"{type(self).__name__} is read-only")
+
+	def __reduce__(self):
+		return (type(self), (self.as_dict(),))
+
+	def get(self, fieldname, default=None):
+		value = getattr(self, fieldname, None)
+		return default if value is None else value
+
+	def as_dict(self):
+		return {fieldname: getattr(self, fieldname) for fieldname in SETTINGS_FIELDS}
+
+
+def get_settings():
+	"""Paymob Settings from the process cache, then Redis, and only then the database"""
+	site = frappe.local.site
+	cached = _local.get(site)
+	if cached and time.monotonic() - cached[1] < LOCAL_TTL:
+		return cached[0]
+
+	values = frappe.cache().get_value(CACHE_KEY)
+	if values is None:
+		values = _load_values()
+		frappe.cache().set_value(CACHE_KEY, values)
+
+	snapshot = PaymobSettingsSnapshot(values)
+	_local[site] = (snapshot, time.monotonic())
+	return snapshot
+
+
+def clear_settings_cache():
+	frappe.cache().delete_value(CACHE_KEY)
+	_local.pop(frappe.local.site, None)
+
+
+def _load_values():
+	values = frappe.db.get_singles_dict(SETTINGS_DOCTYPE, cast=True)
+
+	# Fields that were never saved fall back to their doctype defaults
+	meta = frappe.get_meta(SETTINGS_DOCTYPE)
+	for df in meta.fields:
+		if df.fieldname in SETTINGS_FIELDS and values.get(df.fieldname) is None and df.default is not None:
+			values[df.fieldname] = cast(df.fieldtype, df.default)
+
+	return {fieldname: values.get(fieldname) for fieldname in SETTINGS_FIELDS}
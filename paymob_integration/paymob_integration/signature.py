@@ -0,0 +1,84 @@
+"""Paymob callback HMAC verification.
+
+Paymob signs transaction callbacks with HMAC-SHA512 over the values of a
+fixed, ordered list of `obj` fields and sends the hex digest in the `hmac`
+query parameter. Kept free of frappe imports so it can be benchmarked and
+tested on its own.
+"""
+
+import hashlib
+import hmac
+
+# Order matters: this is the concatenation order documented by Paymob
+TRANSACTION_HMAC_FIELDS = tuple(
+	tuple(path.split("."))
+	for path in (
+		"amount_cents",
+		"created_at",
+		"currency",
+		"error_occured",
+		"has_parent_transaction",
+		"id",
+		"integration_id",
+		"is_3d_secure",
+		"is_auth",
+		"is_capture",
+		"is_refunded",
+		"is_standalone_payment",
+		"is_voided",
+		"order.id",
+		"owner",
+		"pending",
+		"source_data.pan",
+		"source_data.sub_type",
+		"source_data.type",
+		"success",
+	)
+)
+
+
+def _field_value(obj, path):
+	value = obj
+	for key in path:
+		if not isinstance(value, dict):
+			return ""
+		value = value.get(key)
+
+	# Paymob concatenates JSON booleans in lower case, and missing values as empty strings
+	if value is True:
+		return "true"
+	if value is False:
+		return "false"
+	if value is None:
+		return ""
+	return str(value)
+
+
+def transaction_hmac_message(obj):
+	"""The string Paymob signs for a transaction callback `obj`"""
+	return "".join(_field_value(obj, path) for path in TRANSACTION_HMAC_FIELDS)
+
+
+def compute_transaction_hmac(obj, secret):
+	return hmac.new(secret.encode(), transaction_hmac_message(obj).encode(), hashlib.sha512).hexdigest()
+
+
+def verify_transaction_hmac(obj, received, secret):
+	"""Check the `hmac` query parameter of a transaction callback in constant time"""
+	if not (obj and received and secret):
+		return False
+	return _digests_match(compute_transaction_hmac(obj, secret), received)
+
+
+def verify_raw_body_hmac(body, received, secret, digestmod=hashlib.sha512):
+	"""Check a hex HMAC computed over the exact request body bytes, for senders that sign the body"""
+	if not (body and received and secret):
+		return False
+	if isinstance(body, str):
+		body = body.encode()
+	return _digests_match(hmac.new(secret.encode(), body, digestmod).hexdigest(), received)
+
+
+def _digests_match(expected, received):
+	# Compare bytes so a malformed (non-ASCII) header can't raise
+	return hmac.compare_digest(expected.encode(), received.strip().lower().encode())
@@ -0,0 +1,40 @@
+# Copyright (c) 2026, Sarmad and Contributors
+# See license.txt
+
+import frappe
+from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
+from frappe.tests.utils import FrappeTestCase
+
+from paymob_integration.paymob_integration.payment_email import fetch_email_rows, queue_payment_emails
+
+
+class TestPaymentEmail(FrappeTestCase):
+	def test_email_is_logged_and_queued_through_the_email_queue(self):
+		sales_order = make_sales_order(qty=1, rate=100)
+		row = fetch_email_rows([sales_order.name])[sales_order.name]
+		row.contact_email = f"{frappe.generate_hash(length=8)}@example.com"
+		row.paymob_payment_link = "https://example.com/paymob_pay"
+
+		self.assertEqual(queue_payment_emails([row]), [sales_order.name])
+
+		communication = frappe.get_last_doc(
+			"Communication", filters={"reference_doctype": "Sales Order", "reference_name": sales_order.name}
+		)
+		self.assertIn(row.paymob_payment_link, communication.content)
+		self.assertTrue(frappe.db.exists("Email Queue", {"communication": communication.name}))
+
+	def test_unsubscribed_recipient_is_skipped(self):
+		sales_order = make_sales_order(qty=1, rate=100)
+		row = fetch_email_rows([sales_order.name])[sales_order.name]
+		row.contact_email = f"{frappe.generate_hash(length=8)}@example.com"
+		row.paymob_payment_link = "https://example.com/paymob_pay"
+		frappe.get_doc(
+			{"doctype": "Email Unsubscribe", "email": row.contact_email, "global_unsubscribe": 1}
+		).insert(ignore_permissions=True)
+
+		self.assertEqual(queue_payment_emails([row]), [])
+		self.assertFalse(
+			frappe.db.exists(
+				"Communication", {"reference_doctype": "Sales Order", "reference_name": sales_order.name}
+			)
+		)
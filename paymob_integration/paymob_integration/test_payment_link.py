@@ -0,0 +1,85 @@
+# Copyright (c) 2026, Sarmad and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
+from frappe.tests.utils import FrappeTestCase
+
+from paymob_integration.paymob_integration import payment_link, transactions
+from paymob_integration.www import paymob_pay
+
+SETTINGS = frappe._dict(api_key="test-key", integration_id=1, iframe_id=2, payment_key_expiration=3600)
+
+
+class TestPaymentLink(FrappeTestCase):
+	def setUp(self):
+		self.sales_order = make_sales_order(qty=1, rate=100)
+		frappe.db.set_value(
+			"Sales Order",
+			self.sales_order.name,
+			{"paymob_order_id": "4242", "paymob_merchant_order_id": f"{self.sales_order.name}-abc123"},
+		)
+		transactions.record(
+			[
+				{
+					"sales_order": self.sales_order.name,
+					"status": "Pending",
+					"source": "Payment Link",
+					"merchant_order_id": f"{self.sales_order.name}-abc123",
+					"paymob_order_id": "4242",
+					"amount": self.sales_order.grand_total,
+				}
+			],
+			notify=False,
+		)
+		payment_link.clear_link_cache(self.sales_order.name)
+
+	def request(self):
+		row = payment_link.fetch_billing_rows([self.sales_order.name])[self.sales_order.name]
+		with (
+			patch.object(payment_link, "get_auth_token"),
+			patch.object(payment_link, "authed_post", return_value={"id": 5151, "token": "key"}) as post,
+		):
+			link = payment_link.request_payment_link(row, SETTINGS)
+		return link, [call.args[0] for call in post.call_args_list]
+
+	def test_cache_miss_reuses_the_stored_order(self):
+		link, urls = self.request()
+
+		self.assertEqual(link["cache"], "refresh")
+		self.assertEqual(link["paymob_order_id"], 4242)
+		self.assertEqual(urls, [payment_link.PAYMENT_KEY_URL])
+
+	def test_changed_amount_creates_a_new_order(self):
+		frappe.db.set_value(
+			"Sales Order", self.sales_order.name, "grand_total", self.sales_order.grand_total + 50
+		)
+
+		link, urls = self.request()
+
+		self.assertEqual(link["cache"], "miss")
+		self.assertEqual(link["paymob_order_id"], 5151)
+		self.assertEqual(urls, [payment_link.ORDER_URL, payment_link.PAYMENT_KEY_URL])
+
+	def test_short_link_refresh_writes_nothing(self):
+		name = self.sales_order.name
+		modified = frappe.db.get_value("Sales Order", name, "modified")
+		frappe.form_dict.update(order=name, key=payment_link.short_link_key(name))
+		frappe.set_user("Guest")
+		try:
+			with (
+				patch.object(paymob_pay, "get_settings", return_value=SETTINGS),
+				patch.object(payment_link, "get_auth_token"),
+				patch.object(payment_link, "authed_post", return_value={"token": "key"}),
+			):
+				self.assertRaises(paymob_pay.TemporaryRedirect, paymob_pay.get_context, frappe._dict())
+		finally:
+			frappe.set_user("Administrator")
+
+		self.assertEqual(frappe.db.get_value("Sales Order", name, "modified"), modified)
+		self.assertEqual(len(transactions.history(name)), 1)
+		self.assertFalse(
+			frappe.db.exists("Comment", {"reference_doctype": "Sales Order", "reference_name": name})
+		)
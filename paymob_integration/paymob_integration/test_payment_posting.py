@@ -0,0 +1,74 @@
+# Copyright (c) 2026, Sarmad and Contributors
+# See license.txt
+
+import frappe
+from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
+from frappe.tests.utils import FrappeTestCase
+
+from paymob_integration.paymob_integration import transactions
+from paymob_integration.paymob_integration.payment_posting import PaymentEntryPoster, post_payment_entries
+
+
+def make_transaction(sales_order, **kwargs):
+	return {
+		"sales_order": sales_order.name,
+		"amount": sales_order.grand_total,
+		"transaction_id": frappe.generate_hash(length=12),
+		"source": "Webhook",
+		**kwargs,
+	}
+
+
+class TestPaymentPosting(FrappeTestCase):
+	def setUp(self):
+		frappe.db.set_value("Company", "_Test Company", "default_bank_account", "_Test Bank - _TC")
+
+	def test_posts_payment_entry_and_ledger_row(self):
+		sales_order = make_sales_order(qty=1, rate=100)
+		txn = make_transaction(sales_order)
+
+		result = post_payment_entries([txn], commit=False)
+
+		self.assertEqual(result["failed"], {})
+		payment_entry = result["posted"][txn["transaction_id"]]
+		self.assertEqual(frappe.db.get_value("Payment Entry", payment_entry, "docstatus"), 1)
+		self.assertEqual(
+			frappe.db.get_value(
+				"Sales Order", sales_order.name, ["paymob_payment_status", "paymob_payment_entry"]
+			),
+			("Paid", payment_entry),
+		)
+		self.assertEqual(frappe.db.get_value("Sales Order", sales_order.name, "advance_paid"), 100)
+
+		latest = transactions.latest([sales_order.name])[sales_order.name]
+		self.assertEqual((latest.status, latest.payment_entry), ("Paid", payment_entry))
+
+	def test_failing_entry_is_rolled_back_alone(self):
+		good = make_sales_order(qty=1, rate=100)
+		draft = make_sales_order(qty=1, rate=100, do_not_submit=True)
+		good_txn, bad_txn = make_transaction(good), make_transaction(draft)
+
+		result = post_payment_entries([bad_txn, good_txn], commit=False)
+
+		self.assertIn(bad_txn["transaction_id"], result["failed"])
+		self.assertIn(good_txn["transaction_id"], result["posted"])
+		self.assertFalse(frappe.db.exists("Payment Entry", {"reference_no": bad_txn["transaction_id"]}))
+		self.assertFalse(frappe.db.get_value("Sales Order", draft.name, "paymob_payment_status"))
+		self.assertEqual(frappe.db.get_value("Sales Order", good.name, "paymob_payment_status"), "Paid")
+
+	def test_duplicate_reference_is_skipped(self):
+		sales_order = make_sales_order(qty=1, rate=100)
+		txn = make_transaction(sales_order)
+
+		first = post_payment_entries([txn, txn], commit=False)
+		second = post_payment_entries([txn], commit=False)
+
+		payment_entry = first["posted"][txn["transaction_id"]]
+		self.assertEqual(second["skipped"], {txn["transaction_id"]: payment_entry})
+		self.assertEqual(second["posted"], second["skipped"])
+		self.assertEqual(frappe.db.count("Payment Entry", {"reference_no": txn["transaction_id"]}), 1)
+
+	def test_accounts_fall_back_to_company_defaults(self):
+		poster = PaymentEntryPoster()
+		self.assertEqual(poster.company_accounts("_Test Company")[0], "_Test Bank - _TC")
+		self.assertEqual(poster.party_account("_Test Company", "_Test Customer")[0], "Debtors - _TC")
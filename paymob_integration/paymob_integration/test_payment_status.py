@@ -0,0 +1,26 @@
+# Copyright (c) 2026, Sarmad and Contributors
+# See license.txt
+
+import unittest
+
+from paymob_integration.paymob_integration.payment_status import etag_matches
+
+ETAG = 'W/"0123456789abcdef0123456789abcdef"'
+
+
+class TestEtagMatches(unittest.TestCase):
+	def test_matches_whole_tags_in_a_list(self):
+		self.assertTrue(etag_matches(ETAG, ETAG))
+		self.assertTrue(etag_matches(ETAG, f'"other", {ETAG} ,W/"more"'))
+		self.assertTrue(etag_matches(ETAG, '"0123456789abcdef0123456789abcdef"'))
+
+	def test_partial_or_missing_tags_do_not_match(self):
+		self.assertFalse(etag_matches(ETAG, None))
+		self.assertFalse(etag_matches(ETAG, ""))
+		self.assertFalse(etag_matches(ETAG, '"0123456789abcdef"'))
+		self.assertFalse(etag_matches(ETAG, f'{ETAG[:-1]}00"'))
+		self.assertFalse(etag_matches(ETAG, "0123456789abcdef0123456789abcdef"))
+
+	def test_star_matches_any_tag(self):
+		self.assertTrue(etag_matches(ETAG, "*"))
+		self.assertTrue(etag_matches(ETAG, " * "))
@@ -0,0 +1,59 @@
+# Copyright (c) 2026, Sarmad and Contributors
+# See license.txt
+
+import hashlib
+import hmac
+import unittest
+
+from paymob_integration.paymob_integration.signature import (
+	compute_transaction_hmac,
+	transaction_hmac_message,
+	verify_raw_body_hmac,
+	verify_transaction_hmac,
+)
+
+SECRET = "test-hmac-secret"
+
+OBJ = {
+	"amount_cents": 10000,
+	"created_at": "2026-10-17T10:22:05.014237",
+	"currency": "SAR",
+	"error_occured": False,
+	"has_parent_transaction": False,
+	"id": 123,
+	"integration_id": 16745,
+	"is_3d_secure": True,
+	"is_auth": False,
+	"is_capture": False,
+	"is_refunded": False,
+	"is_standalone_payment": True,
+	"is_voided": False,
+	"order": {"id": 456, "merchant_order_id": "SO-0001-abc123"},
+	"owner": 789,
+	"pending": False,
+	"source_data": {"pan": "2346", "sub_type": "MasterCard", "type": "card"},
+	"success": True,
+}
+
+
+class TestSignature(unittest.TestCase):
+	def test_message_follows_paymob_field_order(self):
+		self.assertEqual(
+			transaction_hmac_message(OBJ),
+			"100002026-10-17T10:22:05.014237SARfalsefalse12316745truefalsefalsefalsetruefalse"
+			"456789false2346MasterCardcardtrue",
+		)
+
+	def test_transaction_hmac(self):
+		received = compute_transaction_hmac(OBJ, SECRET)
+		self.assertTrue(verify_transaction_hmac(OBJ, received, SECRET))
+		self.assertTrue(verify_transaction_hmac(OBJ, received.upper(), SECRET))
+		self.assertFalse(verify_transaction_hmac({**OBJ, "amount_cents": 1}, received, SECRET))
+		self.assertFalse(verify_transaction_hmac(OBJ, received, "other-secret"))
+		self.assertFalse(verify_transaction_hmac(OBJ, "ünïcode", SECRET))
+
+	def test_raw_body_hmac(self):
+		body = b'{"obj": {"id": 123}}'
+		received = hmac.new(SECRET.encode(), body, hashlib.sha512).hexdigest()
+		self.assertTrue(verify_raw_body_hmac(body, received, SECRET))
+		self.assertFalse(verify_raw_body_hmac(body + b" ", received, SECRET))
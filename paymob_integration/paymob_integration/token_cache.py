@@ -0,0 +1,136 @@
+import hashlib
+import time
+
+import frappe
+import requests
+from frappe import _
+
+from paymob_integration.paymob_integration import tracing, transport
+
+PAYMOB_AUTH_URL = f"{transport.PAYMOB_BASE_URL}/api/auth/tokens"
+
+# Paymob auth tokens expire after one hour; keep ours for a bit less than that
+TOKEN_TTL = 50 * 60
+# Only one worker refreshes a token at a time, the others wait for its result
+REFRESH_LOCK_TTL = 30
+REFRESH_WAIT = 15
+REFRESH_POLL_INTERVAL = 0.05
+
+# Per-process copy so hot paths don't even need a Redis round trip
+_local_tokens = {}
+
+
+def _token_key(api_key):
+	"""Cache key for an api_key, never the key itself"""
+	return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:32]
+
+
+def get_auth_token(api_key):
+	"""Return a valid Paymob auth token for `api_key`, authenticating only when needed"""
+	if not api_key:
+		frappe.throw(_("Paymob API Key is not configured in Paymob Settings."))
+
+	key = _token_key(api_key)
+	entry = _local_tokens.get(key)
+	if entry and entry["expires_at"] > time.time():
+		return entry["token"]
+
+	entry = frappe.cache().get_value(f"paymob:auth_token:{key}")
+	if not (entry and entry["expires_at"] > time.time()):
+		entry = _refresh_auth_token(api_key, key)
+
+	_local_tokens[key] = entry
+	return entry["token"]
+
+
+def invalidate_auth_token(api_key, token=None):
+	"""Evict a rejected token so the next call re-authenticates.
+
+	When `token` is given, a newer token stored by another worker is left alone.
+	"""
+	key = _token_key(api_key)
+	_local_tokens.pop(key, None)
+
+	cache_key = f"paymob:auth_token:{key}"
+	entry = frappe.cache().get_value(cache_key)
+	if entry and (token is None or entry["token"] == token):
+		frappe.cache().delete_value(cache_key)
+
+
+def call_with_auth_token(api_key, send):
+	"""Call `send(token)` with a cached token; on HTTP 401 evict it and retry once.
+
+	`send` must return a `requests.Response`.
+	"""
+	token = get_auth_token(api_key)
+	response = send(token)
+	if response.status_code == 401:
+		invalidate_auth_token(api_key, token)
+		with tracing.retry(1):
+			response = send(get_auth_token(api_key))
+	return response
+
+
+def authed_post(url, payload, api_key, timeout=None):
+	"""POST `payload` to Paymob with a cached auth token and return the JSON response"""
+	try:
+		resp = call_with_auth_token(
+			api_key,
+			lambda token: transport.post(url, json={**payload, "auth_token": token}, timeout=timeout),
+		)
+	except requests.exceptions.RequestException as e:
+		frappe.throw(_("Network error calling Paymob: {0}").format(e))
+	return transport.json_or_throw(url, resp)
+
+
+def _refresh_auth_token(api_key, key):
+	cache = frappe.cache()
+	cache_key = f"paymob:auth_token:{key}"
+	lock_key = cache.make_key(f"paymob:auth_token_lock:{key}")
+	deadline = time.time() + REFRESH_WAIT
+
+	while True:
+		if cache.set(lock_key, 1, nx=True, ex=REFRESH_LOCK_TTL):
+			try:
+				# Another worker may have finished a refresh while we were waiting
+				entry = cache.get_value(cache_key)
+				if entry and entry["expires_at"] > time.time():
+					return entry
+
+				entry = {"token": _request_auth_token(api_key), "expires_at": time.time() + TOKEN_TTL}
+				cache.set_value(cache_key, entry, expires_in_sec=TOKEN_TTL)
+				return entry
+			finally:
+				cache.delete(lock_key)
+
+		entry = cache.get_value(cache_key)
+		if entry and entry["expires_at"] > time.time():
+			return entry
+
+		if time.time() > deadline:
+			# The refreshing worker is stuck; don't block the caller any longer
+			return {"token": _request_auth_token(api_key), "expires_at": time.time() + TOKEN_TTL}
+
+		time.sleep(REFRESH_POLL_INTERVAL)
+
+
+def _request_auth_token(api_key):
+	"""Authenticate against Paymob and return a fresh token"""
+	try:
+		resp = transport.post(PAYMOB_AUTH_URL, json={"api_key": api_key})
+	except requests.exceptions.RequestException as e:
+		frappe.log_error(f"Paymob Auth Token Error: {e!s}", "Paymob API Error")
+		frappe.throw(_("Error connecting to Paymob Auth API: {0}").format(e))
+
+	# Paymob returns 201 for successful authentication
+	if resp.status_code not in [200, 201]:
+		try:
+			detail = resp.json()
+		except Exception:
+			detail = resp.text
+		frappe.throw(_("Paymob auth failed: {0}").format(detail))
+
+	token = resp.json().get("token")
+	if not token:
+		frappe.throw(_("Paymob auth response did not include a token."))
+	return token
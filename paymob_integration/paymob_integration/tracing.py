@@ -0,0 +1,183 @@
+"""Lightweight timing spans for Paymob/WAHA calls and the DB work around them.
+
+Every span is handed to each sink: an in-memory ring buffer is always on,
+OpenTelemetry is added when the `opentelemetry` package is installed, and
+apps can plug in more through the `paymob_trace_sinks` hook (dotted paths
+to sink factories). This app registers `metrics.RedisSpanSink` there, which
+exports spans as Prometheus metrics aggregated across workers.
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import frappe
+
+RING_BUFFER_SIZE = 500
+
+# Seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Outbound endpoints by URL path, so every call path reports the same span names
+ENDPOINTS = {
+	"/api/auth/tokens": "paymob.auth",
+	"/api/ecommerce/orders": "paymob.order",
+	"/api/acceptance/payment_keys": "paymob.payment_key",
+	"/api/ecommerce/orders/transaction_inquiry": "paymob.inquiry",
+	"/api/sendText": "waha.send_text",
+}
+
+_retry = contextvars.ContextVar("paymob_trace_retry", default=0)
+
+
+class Span:
+	__slots__ = (
+		"duration_ms",
+		"error",
+		"http_status",
+		"kind",
+		"name",
+		"request_bytes",
+		"response_bytes",
+		"retries",
+		"started_at",
+		"status",
+	)
+
+	def __init__(self, name, kind):
+		self.name = name
+		self.kind = kind
+		self.started_at = time.time()
+		self.duration_ms = None
+		self.status = "ok"
+		self.http_status = None
+		self.retries = _retry.get()
+		self.request_bytes = None
+		self.response_bytes = None
+		self.error = None
+
+	def record_response(self, response):
+		"""Take HTTP status and payload sizes from a `requests` response"""
+		self.http_status = response.status_code
+		body = getattr(response.request, "body", None)
+		self.request_bytes = len(body) if body else 0
+		self.response_bytes = len(response.content or b"")
+		if response.status_code >= 400:
+			self.status = "error"
+
+	def as_dict(self):
+		return {field: getattr(self, field) for field in self.__slots__}
+
+
+@contextmanager
+def span(name, kind="db"):
+	"""Time the enclosed block and report it to every sink, also when it raises"""
+	current = Span(name, kind)
+	started = time.perf_counter()
+	try:
+		yield current
+	except BaseException as e:
+		current.status = "error"
+		current.error = type(e).__name__
+		raise
+	finally:
+		current.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+		_emit(current)
+
+
+@contextmanager
+def retry(attempt):
+	"""Mark outbound calls made inside the block as retry number `attempt`"""
+	token = _retry.set(attempt)
+	try:
+		yield
+	finally:
+		_retry.reset(token)
+
+
+def endpoint_name(url, service="paymob"):
+	path = urlsplit(url).path.rstrip("/")
+	if path in ENDPOINTS:
+		return ENDPOINTS[path]
+	if path.startswith("/api/acceptance/iframes"):
+		return "paymob.iframe"
+	return f"{service}.{path.rsplit('/', 1)[-1] or 'request'}"
+
+
+class RingBufferSink:
+	"""Keeps the most recent spans of this process"""
+
+	def __init__(self, size=RING_BUFFER_SIZE):
+		self.spans = deque(maxlen=size)
+
+	def record(self, span):
+		self.spans.append(span.as_dict())
+
+
+class OpenTelemetrySink:
+	"""Re-emits spans through the OpenTelemetry API with their real start and end times"""
+
+	def __init__(self, trace_api):
+		self.tracer = trace_api.get_tracer("paymob_integration")
+
+	def record(self, span):
+		start_ns = int(span.started_at * 1e9)
+		otel_span = self.tracer.start_span(f"paymob_integration.{span.name}", start_time=start_ns)
+		for key in ("kind", "status", "http_status", "retries", "request_bytes", "response_bytes", "error"):
+			value = getattr(span, key)
+			if value is not None:
+				otel_span.set_attribute(f"paymob.{key}", value)
+		otel_span.end(end_time=start_ns + int(span.duration_ms * 1e6))
+
+
+ring_buffer = RingBufferSink()
+
+_sinks = None
+_sinks_lock = threading.Lock()
+
+
+def get_sinks():
+	global _sinks
+	if _sinks is None:
+		with _sinks_lock:
+			if _sinks is None:
+				_sinks = _load_sinks()
+	return _sinks
+
+
+def _load_sinks():
+	sinks = [ring_buffer]
+	try:
+		from opentelemetry import trace as otel_trace
+	except ImportError:
+		pass
+	else:
+		sinks.append(OpenTelemetrySink(otel_trace))
+
+	if getattr(frappe.local, "site", None):
+		for path in frappe.get_hooks("paymob_trace_sinks"):
+			try:
+				sinks.append(frappe.get_attr(path)())
+			except Exception:
+				frappe.log_error(title=f"Paymob Trace Sink Error: {path}")
+	return sinks
+
+
+def _emit(current):
+	for sink in get_sinks():
+		try:
+			sink.record(current)
+		except Exception:
+			# Tracing must never break a payment
+			pass
+
+
+@frappe.whitelist()
+def recent_spans(limit=100):
+	"""The latest spans recorded by this worker process, newest first"""
+	frappe.only_for("System Manager")
+	spans = list(ring_buffer.spans)
+	return spans[::-1][: int(limit)]
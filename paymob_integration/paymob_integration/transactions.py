@@ -0,0 +1,128 @@
+"""Append-only ledger of Paymob payment attempts and callbacks.
+
+Every payment link, callback, inquiry and reconciliation result adds one
+Paymob Transaction row, so the full history of a Sales Order is kept and
+its latest row is its current payment state. The reconciliation sweep
+reads this narrow, indexed table instead of `tabSales Order`; the Paymob
+fields on Sales Order mirror each order's latest row and serve status reads.
+"""
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+from paymob_integration.paymob_integration import payment_status, tracing
+
+DOCTYPE = "Paymob Transaction"
+
+LEDGER_FIELDS = (
+	"sales_order",
+	"status",
+	"source",
+	"merchant_order_id",
+	"paymob_order_id",
+	"transaction_id",
+	"amount",
+	"currency",
+	"payment_entry",
+)
+
+
+def record(entries, notify=True):
+	"""Append ledger rows with one insert; each entry is a dict with (some of) `LEDGER_FIELDS`.
+
+	With `notify`, cached statuses of the Sales Orders are dropped and their
+	new status is pushed to listening clients.
+	"""
+	if not entries:
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	values = []
+	for i, entry in enumerate(entries):
+		# Later entries of one call are later events; keep their order in `creation`
+		creation = add_to_date(now, microseconds=i)
+		values.append(
+			[
+				frappe.generate_hash(length=10),
+				creation,
+				creation,
+				user,
+				user,
+				*(_value(entry, f) for f in LEDGER_FIELDS),
+			]
+		)
+	with tracing.span("transaction.record"):
+		frappe.db.bulk_insert(
+			DOCTYPE, ["name", "creation", "modified", "owner", "modified_by", *LEDGER_FIELDS], values
+		)
+	if notify:
+		payment_status.status_changed(entries)
+
+
+def history(sales_order_name, limit=20):
+	"""The latest ledger rows of one Sales Order, newest first"""
+	return frappe.get_all(
+		DOCTYPE,
+		filters={"sales_order": sales_order_name},
+		fields=["name", "creation", *LEDGER_FIELDS],
+		order_by="creation desc, name desc",
+		limit=limit,
+	)
+
+
+def latest(sales_order_names):
+	"""The latest ledger row of each of many Sales Orders, keyed by Sales Order name"""
+	if not sales_order_names:
+		return {}
+
+	rows = frappe.db.sql(
+		f"""
+        select t.name, t.creation, {", ".join(f"t.{f}" for f in LEDGER_FIELDS)}
+        from `tabPaymob Transaction` t
+        where t.sales_order in %(names)s
+            and not exists (
+                select 1 from `tabPaymob Transaction` later
+                where later.sales_order = t.sales_order
+                    and (later.creation, later.name) > (t.creation, t.name)
+            )
+        """,
+		{"names": tuple(sales_order_names)},
+		as_dict=True,
+	)
+	return {row.sales_order: row for row in rows}
+
+
+def pending(since, after="", limit=100):
+	"""Ledger rows that are still the latest, Pending state of their Sales Order.
+
+	Only rows with a Paymob order modified since `since` are returned, in
+	name order after `after` for keyset pagination.
+	"""
+	return frappe.db.sql(
+		"""
+        select t.name, t.sales_order, t.paymob_order_id, t.merchant_order_id
+        from `tabPaymob Transaction` t
+        where t.status = 'Pending'
+            and t.modified >= %(since)s
+            and t.name > %(after)s
+            and coalesce(t.paymob_order_id, '') != ''
+            and not exists (
+                select 1 from `tabPaymob Transaction` later
+                where later.sales_order = t.sales_order
+                    and (later.creation, later.name) > (t.creation, t.name)
+            )
+        order by t.name
+        limit %(limit)s
+        """,
+		{"since": since, "after": after, "limit": limit},
+		as_dict=True,
+	)
+
+
+def _value(entry, fieldname):
+	value = entry.get(fieldname)
+	# Paymob sends its ids as numbers
+	if value is not None and fieldname.endswith("_id"):
+		return str(value)
+	return value
@@ -0,0 +1,132 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import frappe
+import requests
+from frappe import _
+from frappe.utils import flt
+from requests.adapters import HTTPAdapter
+
+from paymob_integration.paymob_integration import rate_limit, resilience, tracing
+from paymob_integration.paymob_integration.settings import get_settings
+
+PAYMOB_BASE_URL = "https://ksa.paymob.com"  # KSA environment
+
+# Connection pool size per upstream service. Paymob is hit by link creation,
+# inquiries and bulk jobs; WAHA only by notifications.
+POOL_SIZES = {
+	"paymob": 20,
+	"waha": 5,
+}
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+def get_session(service="paymob"):
+	"""Return the per-process pooled `requests.Session` for `service`"""
+	global _sessions_pid
+
+	with _sessions_lock:
+		if _sessions_pid != os.getpid():
+			# Pooled sockets must not be shared with a forked child
+			_sessions.clear()
+			_sessions_pid = os.getpid()
+
+		session = _sessions.get(service)
+		if session is None:
+			session = _sessions[service] = _make_session(POOL_SIZES.get(service, 10))
+
+	return session
+
+
+def _make_session(pool_size):
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	session.headers.update(
+		{
+			"Accept-Encoding": "gzip, deflate",
+			"Connection": "keep-alive",
+		}
+	)
+	return session
+
+
+def get_timeouts():
+	"""(connect, read) timeouts in seconds as configured in Paymob Settings"""
+	try:
+		settings = get_settings()
+		connect_timeout = flt(settings.get("connect_timeout")) or DEFAULT_CONNECT_TIMEOUT
+		read_timeout = flt(settings.get("read_timeout")) or DEFAULT_READ_TIMEOUT
+	except Exception:
+		connect_timeout, read_timeout = DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+	return connect_timeout, read_timeout
+
+
+def resolve_url(url):
+	"""Send Paymob calls to `paymob_base_url` from site config when set, e.g. a local stand-in"""
+	base_url = frappe.conf.get("paymob_base_url")
+	if base_url and url.startswith(PAYMOB_BASE_URL):
+		return base_url.rstrip("/") + url[len(PAYMOB_BASE_URL) :]
+	return url
+
+
+def request(method, url, service="paymob", timeout=None, **kwargs):
+	"""Send a request over the pooled session for `service`.
+
+	Waits for the shared rate limit of the endpoint (see `rate_limit`), goes
+	through the shared circuit breaker and retries transient failures
+	(see `resilience`). Raises the usual `requests.exceptions.RequestException`
+	subclasses on network errors, so callers keep their existing error handling.
+	"""
+	if timeout is None:
+		timeout = get_timeouts()
+	endpoint = tracing.endpoint_name(url, service)
+	session = get_session(service)
+	target = resolve_url(url)
+
+	def send(attempt):
+		rate_limit.acquire(endpoint)
+		with tracing.retry(attempt - 1) if attempt > 1 else nullcontext():
+			with tracing.span(endpoint, kind="http") as span:
+				response = session.request(method, target, timeout=timeout, **kwargs)
+				span.record_response(response)
+		return response
+
+	return resilience.call(send, endpoint)
+
+
+def post(url, json=None, service="paymob", **kwargs):
+	return request("POST", url, service=service, json=json, **kwargs)
+
+
+def site_executor(max_workers):
+	"""Thread pool whose threads are initialised for the current site.
+
+	Worker threads get the site config and Redis cache but no database
+	connection, so submitted work must stick to HTTP and cache calls.
+	"""
+	return ThreadPoolExecutor(
+		max_workers=max_workers,
+		initializer=frappe.init,
+		initargs=(frappe.local.site, frappe.local.sites_path),
+	)
+
+
+def json_or_throw(url, resp):
+	"""Return the JSON body of a 2xx response, or throw with Paymob's error details"""
+	if not (200 <= resp.status_code < 300):
+		try:
+			details = resp.json()
+		except Exception:
+			details = resp.text
+		frappe.throw(_("Paymob API error at {0}: HTTP {1} - {2}").format(url, resp.status_code, details))
+	return resp.json()
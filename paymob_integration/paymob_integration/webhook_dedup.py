@@ -0,0 +1,72 @@
+import frappe
+
+from paymob_integration.paymob_integration import tracing
+
+# A claimed transaction stays "in flight" in Redis only briefly, so a worker
+# that dies mid-processing doesn't block Paymob's retries for long. Once the
+# processing transaction commits, the key is kept for a week.
+PROCESSING_TTL = 10 * 60
+PROCESSED_TTL = 7 * 24 * 60 * 60
+
+
+def _redis_key(transaction_id):
+	return frappe.cache().make_key(f"paymob:webhook_txn:{transaction_id}")
+
+
+def claim_transaction(transaction_id, webhook_data, payload=None):
+	"""Return True if this is the first delivery of `transaction_id` and it should be processed.
+
+	Redis SETNX answers repeated deliveries without touching the database; the
+	unique Paymob Webhook Event row is the durable record when Redis has lost the key.
+	When the raw `payload` is given, the event is stored as Queued for the inbox worker.
+	"""
+	status = "Queued" if payload else "Received"
+	if not frappe.cache().set(_redis_key(transaction_id), 1, nx=True, ex=PROCESSING_TTL):
+		return False
+
+	obj = webhook_data.get("obj") or {}
+	try:
+		with tracing.span("webhook.record_event"):
+			frappe.get_doc(
+				{
+					"doctype": "Paymob Webhook Event",
+					"transaction_id": transaction_id,
+					"status": status,
+					"payload": payload,
+					"success": 1 if obj.get("success") else 0,
+					"merchant_order_id": (obj.get("order") or {}).get("merchant_order_id"),
+					"paymob_order_id": (obj.get("order") or {}).get("id"),
+				}
+			).insert(ignore_permissions=True)
+	except frappe.DuplicateEntryError:
+		if frappe.db.get_value("Paymob Webhook Event", transaction_id, "status") != "Failed":
+			_remember_processed(transaction_id)
+			return False
+		# A previous attempt failed; let this delivery retry it
+		frappe.db.set_value(
+			"Paymob Webhook Event",
+			transaction_id,
+			{"status": status, "payload": payload, "attempts": 0, "error": None},
+		)
+
+	if payload:
+		# Queued events are durable as soon as they commit
+		frappe.db.after_commit.add(lambda: _remember_processed(transaction_id))
+
+	return True
+
+
+def mark_processed(transaction_id):
+	frappe.db.set_value("Paymob Webhook Event", transaction_id, "status", "Processed")
+	frappe.db.after_commit.add(lambda: _remember_processed(transaction_id))
+
+
+def release_transaction(transaction_id, error=None):
+	"""Forget a claim whose processing failed, so Paymob's next retry is processed again"""
+	frappe.cache().delete(_redis_key(transaction_id))
+	if frappe.db.exists("Paymob Webhook Event", transaction_id):
+		frappe.db.set_value("Paymob Webhook Event", transaction_id, {"status": "Failed", "error": error})
+
+
+def _remember_processed(transaction_id):
+	frappe.cache().set(_redis_key(transaction_id), 1, ex=PROCESSED_TTL)
@@ -0,0 +1,191 @@
+import json
+import time
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+from paymob_integration.paymob_integration import metrics
+from paymob_integration.paymob_integration.payment_posting import (
+	post_payment_entries,
+	record_failed_payment,
+	transaction_from_webhook,
+)
+from paymob_integration.paymob_integration.settings import get_settings
+
+# Events per inbox fetch, and how often a failing event is retried before it is left as Failed
+DRAIN_BATCH_SIZE = 50
+MAX_ATTEMPTS = 3
+
+# A drain stops claiming new batches after DRAIN_TIME_BUDGET seconds, well inside the job
+# timeout; events left in Processing longer than LEASE_SECONDS belong to a dead worker
+DRAIN_TIMEOUT = 600
+DRAIN_TIME_BUDGET = 8 * 60
+LEASE_SECONDS = 15 * 60
+
+# Processed events are kept this long, well past Paymob's redelivery window, for deduplication
+PROCESSED_RETENTION_DAYS = 30
+
+
+def enqueue_inbox_drain():
+	"""Start the inbox worker once the current transaction has committed the queued event"""
+	frappe.enqueue(
+		"paymob_integration.paymob_integration.webhook_queue.drain_webhook_inbox",
+		queue="short",
+		timeout=DRAIN_TIMEOUT,
+		job_id="paymob_webhook_inbox",
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+@metrics.timer("drain_webhook_inbox")
+def drain_webhook_inbox(batch_size=DRAIN_BATCH_SIZE):
+	"""Process queued Paymob webhook events in batches until the inbox is empty.
+
+	Payment Entries for a batch are posted together through
+	`post_payment_entries`, so a settlement burst costs one commit per batch.
+	Runs from `enqueue_inbox_drain` and, as a safety net, from the scheduler,
+	which also picks up whatever a run leaves after its time budget.
+	"""
+	if not get_settings().queue_webhooks and not _has_pending_events():
+		return
+
+	requeue_stale_events()
+
+	deadline = time.monotonic() + DRAIN_TIME_BUDGET
+	while time.monotonic() < deadline:
+		names = _claim_batch(batch_size)
+		if not names:
+			break
+		try:
+			_process_batch(names)
+		except Exception:
+			# Don't strand the batch in Processing; later runs retry it
+			frappe.db.rollback()
+			_fail_batch(names, frappe.get_traceback())
+			break
+
+
+def _has_pending_events():
+	# Events queued before background processing was switched off still need a worker
+	return bool(frappe.db.exists("Paymob Webhook Event", {"status": ["in", ["Queued", "Processing"]]}))
+
+
+def clear_processed_events(days=PROCESSED_RETENTION_DAYS):
+	"""Delete Processed events older than `days`; runs daily from the scheduler"""
+	Event = frappe.qb.DocType("Paymob Webhook Event")
+	(
+		frappe.qb.from_(Event)
+		.delete()
+		.where((Event.status == "Processed") & (Event.creation < add_to_date(now_datetime(), days=-days)))
+	).run()
+	frappe.db.commit()
+
+
+def requeue_stale_events():
+	"""Put events whose worker died mid-batch back in the queue, counting it as a failed attempt"""
+	Event = frappe.qb.DocType("Paymob Webhook Event")
+	stale_before = add_to_date(now_datetime(), seconds=-LEASE_SECONDS)
+	events = (
+		frappe.qb.from_(Event)
+		.select(Event.name, Event.attempts)
+		.where(
+			(Event.status == "Processing") & (Event.claimed_at.isnull() | (Event.claimed_at < stale_before))
+		)
+		.for_update(skip_locked=True)
+	).run(as_dict=True)
+
+	for event in events:
+		_set_failed(event, "Processing lease expired before the event was finished")
+	frappe.db.commit()
+
+
+def _claim_batch(batch_size):
+	"""Move the oldest queued events to Processing, skipping rows another worker holds"""
+	Event = frappe.qb.DocType("Paymob Webhook Event")
+	names = (
+		frappe.qb.from_(Event)
+		.select(Event.name)
+		.where(Event.status == "Queued")
+		.orderby(Event.creation)
+		.limit(batch_size)
+		.for_update(skip_locked=True)
+	).run(pluck=True)
+
+	if names:
+		(
+			frappe.qb.update(Event)
+			.set(Event.status, "Processing")
+			.set(Event.claimed_at, now_datetime())
+			.where(Event.name.isin(names))
+		).run()
+	frappe.db.commit()
+	return names
+
+
+def _process_batch(names):
+	events = frappe.get_all(
+		"Paymob Webhook Event",
+		filters={"name": ["in", names]},
+		fields=["name", "payload", "attempts"],
+		order_by="creation asc",
+	)
+
+	paid = {}
+	for event in events:
+		frappe.db.savepoint("paymob_webhook_event")
+		try:
+			txn = transaction_from_webhook(json.loads(event.payload))
+			if txn and txn.success:
+				paid[event.name] = txn
+				continue
+			if txn:
+				record_failed_payment(txn)
+			_set_status(event, "Processed")
+		except Exception:
+			frappe.db.rollback(save_point="paymob_webhook_event")
+			_set_failed(event, frappe.get_traceback())
+
+	if paid:
+		result = post_payment_entries(paid.values(), commit=False)
+		for event in events:
+			txn = paid.get(event.name)
+			if not txn:
+				continue
+			error = result["failed"].get(str(txn.transaction_id))
+			if error:
+				_set_failed(event, error)
+			else:
+				_set_status(event, "Processed")
+
+	frappe.db.commit()
+
+
+def _fail_batch(names, error):
+	events = frappe.get_all(
+		"Paymob Webhook Event",
+		filters={"name": ["in", names], "status": "Processing"},
+		fields=["name", "attempts"],
+	)
+	for event in events:
+		_set_failed(event, error)
+	frappe.db.commit()
+	frappe.log_error(error, "Paymob Webhook Inbox Error")
+
+
+def _set_status(event, status):
+	frappe.db.set_value("Paymob Webhook Event", event.name, "status", status)
+
+
+def _set_failed(event, error):
+	attempts = (event.attempts or 0) + 1
+	frappe.db.set_value(
+		"Paymob Webhook Event",
+		event.name,
+		{
+			# Failed events go back to the end of the queue until they run out of attempts
+			"status": "Queued" if attempts < MAX_ATTEMPTS else "Failed",
+			"attempts": attempts,
+			"error": error,
+		},
+	)
@@ -0,0 +1,23 @@
+def chat_id(phone_number):
+	"""WAHA chat id for a phone number"""
+	# Clean phone number (remove + and spaces, ensure it starts with country code)
+	clean_phone = phone_number.replace("+", "").replace(" ", "").replace("-", "")
+
+	# If phone doesn't start with country code, assume Saudi Arabia (+966)
+	if not clean_phone.startswith("966"):
+		clean_phone = "966" + clean_phone.lstrip("0")
+
+	return f"{clean_phone}@c.us"
+
+
+def order_message(sales_order_name):
+	return f"Thank you for your order with Sage Services! Order: {sales_order_name}"
+
+
+def send_text_url(waha_url):
+	"""WAHA API endpoint for sending messages"""
+	return f"{(waha_url or 'http://localhost:3000').rstrip('/')}/api/sendText"
+
+
+def build_text_payload(phone_number, message, session_name):
+	return {"chatId": chat_id(phone_number), "text": message, "session": session_name or "default"}
@@ -0,0 +1,194 @@
+import random
+import time
+
+import frappe
+from frappe.utils import add_to_date, flt, now_datetime, strip_html
+
+from paymob_integration.paymob_integration import metrics, transport, whatsapp
+from paymob_integration.paymob_integration.settings import get_settings
+
+OUTBOX_DOCTYPE = "Paymob WhatsApp Message"
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+# Retry delays grow from RETRY_BASE seconds up to RETRY_CAP
+RETRY_BASE = 30
+RETRY_CAP = 60 * 60
+DEFAULT_MESSAGES_PER_SECOND = 1
+
+# Only one consumer drains the outbox, so per-session pacing can stay in memory
+CONSUMER_LOCK_TTL = 10 * 60
+# A run only claims what it can send within DRAIN_TIME_BUDGET seconds and leaves the rest to
+# the scheduler; Sending rows whose lease (next_attempt_at) has passed belong to a dead run
+DRAIN_TIME_BUDGET = 8 * 60
+LEASE_SECONDS = 15 * 60
+
+
+def queue_message(phone_number, message, sales_order=None):
+	"""Add a WhatsApp message to the outbox; it goes out once the current transaction commits"""
+	settings = get_settings()
+	frappe.get_doc(
+		{
+			"doctype": OUTBOX_DOCTYPE,
+			"sales_order": sales_order,
+			"phone_number": phone_number,
+			"session_name": settings.whatsapp_session_name or "default",
+			"message": message,
+			"status": "Queued",
+			"next_attempt_at": now_datetime(),
+		}
+	).insert(ignore_permissions=True)
+	enqueue_outbox_drain()
+
+
+def enqueue_outbox_drain():
+	frappe.enqueue(
+		"paymob_integration.paymob_integration.whatsapp_outbox.drain_whatsapp_outbox",
+		queue="long",
+		timeout=CONSUMER_LOCK_TTL,
+		job_id="paymob_whatsapp_outbox",
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+@metrics.timer("drain_whatsapp_outbox")
+def drain_whatsapp_outbox(batch_size=BATCH_SIZE):
+	"""Send due outbox messages over one pooled WAHA connection for up to DRAIN_TIME_BUDGET.
+
+	Messages are paced per WAHA session at the configured rate; failures are
+	retried with exponential backoff and marked Failed after MAX_ATTEMPTS.
+	Runs from `enqueue_outbox_drain` and, as a safety net, from the scheduler,
+	which also picks up whatever a run leaves behind.
+	"""
+	cache = frappe.cache()
+	lock_key = cache.make_key("paymob:whatsapp_outbox:consumer")
+	if not cache.set(lock_key, 1, nx=True, ex=CONSUMER_LOCK_TTL):
+		return
+
+	try:
+		settings = get_settings()
+		if not settings.enable_whatsapp_notifications:
+			return
+
+		requeue_stale_messages()
+
+		interval = 1 / (flt(settings.whatsapp_messages_per_second) or DEFAULT_MESSAGES_PER_SECOND)
+		deadline = time.monotonic() + DRAIN_TIME_BUDGET
+		next_send_at = {}
+		while True:
+			# Never claim more than the rest of the budget can send
+			limit = min(batch_size, int((deadline - time.monotonic()) / interval))
+			if limit < 1:
+				break
+			messages = _claim_batch(limit)
+			if not messages:
+				break
+			_send_batch(messages, settings, interval, next_send_at)
+			cache.expire(lock_key, CONSUMER_LOCK_TTL)
+	finally:
+		cache.delete(lock_key)
+
+
+def requeue_stale_messages():
+	"""Retry messages a dead run left in Sending; whether they went out is unknown"""
+	Message = frappe.qb.DocType(OUTBOX_DOCTYPE)
+	messages = (
+		frappe.qb.from_(Message)
+		.select(Message.name, Message.attempts)
+		.where((Message.status == "Sending") & (Message.next_attempt_at < now_datetime()))
+		.for_update(skip_locked=True)
+	).run(as_dict=True)
+
+	frappe.db.bulk_update(
+		OUTBOX_DOCTYPE,
+		{
+			message.name: _retry_values(message, "Sending lease expired before the send was recorded")
+			for message in messages
+		},
+	)
+	frappe.db.commit()
+
+
+def _claim_batch(batch_size):
+	Message = frappe.qb.DocType(OUTBOX_DOCTYPE)
+	messages = (
+		frappe.qb.from_(Message)
+		.select(Message.name, Message.phone_number, Message.message, Message.session_name, Message.attempts)
+		.where((Message.status == "Queued") & (Message.next_attempt_at <= now_datetime()))
+		.orderby(Message.next_attempt_at)
+		.limit(batch_size)
+		.for_update(skip_locked=True)
+	).run(as_dict=True)
+
+	if messages:
+		(
+			frappe.qb.update(Message)
+			.set(Message.status, "Sending")
+			.set(Message.next_attempt_at, add_to_date(now_datetime(), seconds=LEASE_SECONDS))
+			.where(Message.name.isin([m.name for m in messages]))
+		).run()
+	frappe.db.commit()
+	return messages
+
+
+def _send_batch(messages, settings, interval, next_send_at):
+	url = whatsapp.send_text_url(settings.waha_api_url)
+	updates = {}
+
+	for message in messages:
+		session_name = message.session_name or "default"
+		wait = next_send_at.get(session_name, 0) - time.monotonic()
+		if wait > 0:
+			time.sleep(wait)
+		next_send_at[session_name] = time.monotonic() + interval
+
+		payload = whatsapp.build_text_payload(message.phone_number, message.message, session_name)
+		try:
+			response = transport.post(url, json=payload, service="waha")
+		except Exception as e:
+			updates[message.name] = _retry_values(message, strip_html(str(e)) or repr(e))
+			continue
+
+		if response.status_code in [200, 201]:
+			metrics.incr("paymob_whatsapp_messages_total", status="ok")
+			updates[message.name] = {
+				"status": "Sent",
+				"sent_at": now_datetime(),
+				"attempts": (message.attempts or 0) + 1,
+				"waha_message_id": _message_id(response),
+				"error": None,
+			}
+		else:
+			updates[message.name] = _retry_values(
+				message, f"WAHA HTTP {response.status_code}: {response.text[:1000]}"
+			)
+
+	frappe.db.bulk_update(OUTBOX_DOCTYPE, updates)
+	frappe.db.commit()
+
+
+def _retry_values(message, error):
+	metrics.incr("paymob_whatsapp_messages_total", status="error")
+	attempts = (message.attempts or 0) + 1
+	if attempts >= MAX_ATTEMPTS:
+		return {"status": "Failed", "attempts": attempts, "error": error}
+
+	delay = min(RETRY_CAP, RETRY_BASE * 2 ** (attempts - 1))
+	return {
+		"status": "Queued",
+		"attempts": attempts,
+		"error": error,
+		"next_attempt_at": add_to_date(now_datetime(), seconds=random.uniform(delay / 2, delay)),
+	}
+
+
+def _message_id(response):
+	try:
+		message_id = response.json().get("id")
+	except Exception:
+		return None
+	# WAHA returns either a plain id or an object with `_serialized`
+	if isinstance(message_id, dict):
+		message_id = message_id.get("_serialized")
+	return message_id
@@ -0,0 +1,47 @@
+import frappe
+from frappe import _
+
+from paymob_integration.paymob_integration import payment_link
+from paymob_integration.paymob_integration.settings import get_settings
+
+no_cache = 1
+
+
+class TemporaryRedirect(frappe.Redirect):
+	# Payment keys expire, so browsers must not remember where this redirected to
+	http_status_code = 302
+
+
+def get_context(context):
+	"""Short payment link: get a valid payment key for the Sales Order's Paymob order and redirect to it.
+
+	Keys come from the link cache while valid; only expired ones are renewed,
+	so Paymob is called only for customers who actually open their link. The
+	page is served to guests, so it only writes when a new Paymob order has
+	to be stored.
+	"""
+	name = frappe.form_dict.order
+	if not payment_link.verify_short_link(name, frappe.form_dict.key):
+		raise frappe.DoesNotExistError
+
+	order = frappe.db.get_value("Sales Order", name, ["docstatus", "paymob_payment_status"], as_dict=True)
+	if not order or order.docstatus != 1:
+		raise frappe.DoesNotExistError
+
+	if order.paymob_payment_status == "Paid":
+		context.title = _("Payment received")
+		context.sales_order = name
+		return
+
+	settings = get_settings()
+	payment_link.validate_settings(settings)
+	row = payment_link.fetch_billing_rows([name])[name]
+	link = payment_link.request_payment_link(row, settings)
+	if link["cache"] == "miss":
+		# Store the new Paymob order so the next click reuses it; GET requests
+		# are not committed by the framework. Hits and refreshed keys write nothing.
+		payment_link.save_link(name, link)
+		frappe.db.commit()
+
+	frappe.local.flags.redirect_location = link["payment_url"]
+	raise TemporaryRedirect
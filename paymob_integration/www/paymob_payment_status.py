@@ -0,0 +1,24 @@
+import frappe
+from frappe import _
+
+from paymob_integration.paymob_integration.payment_status import STATUS_EVENT, get_statuses
+
+no_cache = 1
+
+
+def get_context(context):
+	"""Live payment status of one of the customer's Sales Orders, e.g. /paymob_payment_status?name=SAL-ORD-0001"""
+	if frappe.session.user == "Guest":
+		frappe.throw(_("You need to be logged in to access this page"), frappe.PermissionError)
+
+	name = frappe.form_dict.name
+	if not name or not frappe.db.exists("Sales Order", name):
+		raise frappe.DoesNotExistError
+
+	if not frappe.has_website_permission(frappe.get_doc("Sales Order", name)):
+		frappe.throw(_("Not permitted"), frappe.PermissionError)
+
+	context.sales_order = name
+	context.status = get_statuses([name]).get(name) or {}
+	context.status_event = STATUS_EVENT
+	context.title = _("Payment for {0}").format(name)